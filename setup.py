@@ -41,6 +41,7 @@ setup(name='activities.metamodel',
       install_requires=[
           'setuptools',
           'zope.interface',
+          'odict',
           'zodict',
           # -*- Extra requirements: -*
       ],
@@ -51,5 +52,7 @@ setup(name='activities.metamodel',
       },
       entry_points="""
       # -*- Entry points: -*-
+      [console_scripts]
+      activities-benchmark = activities.metamodel.benchmark.runner:main
       """,
       )
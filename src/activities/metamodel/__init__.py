@@ -25,7 +25,11 @@ from activities.metamodel.elements import Profile
 from activities.metamodel.elements import Stereotype
 from activities.metamodel.elements import TaggedValue
 from activities.metamodel.elements import validate
+from activities.metamodel.elements import revalidate
 from activities.metamodel.elements import get_element_by_xmiid
+from activities.metamodel.elements import get_elements_by_stereotype
+from activities.metamodel.elements import set_element_base
+from activities.metamodel.frozen import freeze
 
 from activities.metamodel.interfaces import IPackage
 from activities.metamodel.interfaces import IActivity
@@ -43,4 +47,5 @@ from activities.metamodel.interfaces import IPreConstraint
 from activities.metamodel.interfaces import IPostConstraint
 from activities.metamodel.interfaces import IProfile
 from activities.metamodel.interfaces import IStereotype
+from activities.metamodel.interfaces import IStereotypeApplication
 from activities.metamodel.interfaces import ITaggedValue
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+from activities.metamodel.elements import ModelIllFormedException
+from activities.metamodel.frozen import ACTIVITY_FINAL
+from activities.metamodel.frozen import DECISION
+from activities.metamodel.frozen import FLOW_FINAL
+from activities.metamodel.frozen import FORK
+from activities.metamodel.frozen import INITIAL
+from activities.metamodel.frozen import JOIN
+from activities.metamodel.frozen import FrozenActivity
+
+### ISSUE KINDS
+UNREACHABLE = 'unreachable'
+NO_FINAL = 'no_final'
+JOIN_UNPAIRED = 'join_unpaired'
+JOIN_EXCLUSIVE = 'join_exclusive'
+JOIN_OVERFLOW = 'join_overflow'
+
+# no dominator, for unreachable nodes
+NONE = -1
+
+
+class Issue(object):
+    """A soundness issue of a node.
+    """
+
+    def __init__(self, kind, node, message):
+        self.kind = kind
+        self.node = node
+        self.message = message
+
+    def __repr__(self):
+        return '<Issue %s %s>' % (self.kind, str(self.node))
+
+    def __str__(self):
+        return str(self.node) + " " + self.message
+
+
+def _search(count, starts, neighbours):
+    """Nodes reachable from starts, as list of flags by node id.
+    """
+    seen = [False] * count
+    stack = list()
+    for start in starts:
+        if not seen[start]:
+            seen[start] = True
+            stack.append(start)
+    while stack:
+        i = stack.pop()
+        for j in neighbours(i):
+            if not seen[j]:
+                seen[j] = True
+                stack.append(j)
+    return seen
+
+
+def _compress(v, ancestor, label, semi):
+    """Path compression of the forest of Lengauer and Tarjan, iterative.
+    """
+    path = list()
+    while ancestor[ancestor[v]] != NONE:
+        path.append(v)
+        v = ancestor[v]
+    for v in reversed(path):
+        a = ancestor[v]
+        if semi[label[a]] < semi[label[v]]:
+            label[v] = label[a]
+        ancestor[v] = ancestor[a]
+
+
+def dominators(frozen):
+    """Immediate dominators of the nodes of a frozen activity, as list by
+    node id.
+
+    A node d dominates n if every path from an initial node to n passes d.
+    The initial nodes are dominated by a virtual root, their entry is their
+    own id. Nodes not reachable have NONE. Computed by the algorithm of
+    Lengauer and Tarjan with path compression, in O(m log n) for m edges and
+    n nodes.
+    """
+    count = len(frozen)
+    initials = frozen.of_kind(INITIAL)
+    initial = set(initials)
+    root = count
+    def successors(v):
+        if v == root:
+            return initials
+        return frozen.successors(v)
+    def predecessors(v):
+        if v in initial:
+            return [root] + frozen.predecessors(v)
+        return frozen.predecessors(v)
+    # depth first numbering from the virtual root. semi holds the number
+    # until it is replaced by the number of the semidominator
+    semi = [NONE] * (count + 1)
+    parent = [NONE] * (count + 1)
+    vertex = list()
+    stack = [(root, NONE)]
+    while stack:
+        v, p = stack.pop()
+        if semi[v] != NONE:
+            continue
+        semi[v] = len(vertex)
+        vertex.append(v)
+        parent[v] = p
+        for w in reversed(successors(v)):
+            if semi[w] == NONE:
+                stack.append((w, v))
+    ancestor = [NONE] * (count + 1)
+    label = range(count + 1)
+    bucket = [list() for v in xrange(count + 1)]
+    idom = [NONE] * (count + 1)
+    def evaluate(v):
+        if ancestor[v] == NONE:
+            return v
+        _compress(v, ancestor, label, semi)
+        return label[v]
+    for n in xrange(len(vertex) - 1, 0, -1):
+        w = vertex[n]
+        for v in predecessors(w):
+            if semi[v] == NONE:
+                # not reachable
+                continue
+            u = evaluate(v)
+            if semi[u] < semi[w]:
+                semi[w] = semi[u]
+        bucket[vertex[semi[w]]].append(w)
+        p = parent[w]
+        ancestor[w] = p
+        for v in bucket[p]:
+            u = evaluate(v)
+            if semi[u] < semi[v]:
+                idom[v] = u
+            else:
+                idom[v] = p
+        bucket[p] = list()
+    for n in xrange(1, len(vertex)):
+        w = vertex[n]
+        if idom[w] != vertex[semi[w]]:
+            idom[w] = idom[idom[w]]
+    result = idom[:count]
+    for i in initials:
+        result[i] = i
+    return result
+
+
+class Analysis(object):
+    """Global structure of an activity.
+
+    reachable[i] tells whether node i is reachable from an initial node,
+    finishing[i] whether a final node is reachable from node i. idom holds
+    the immediate dominators, see dominators. pairs maps the ids of paired
+    join nodes to the ids of the fork nodes opening them. issues lists the
+    soundness issues found, by node id.
+
+    The dominators take O(m log n) for m edges and n nodes, pairing the j
+    joins O(j * (n + m)), see _branches.
+    """
+
+    def __init__(self, activity):
+        if isinstance(activity, FrozenActivity):
+            self.frozen = activity
+        else:
+            self.frozen = FrozenActivity(activity)
+        frozen = self.frozen
+        count = len(frozen)
+        self.reachable = _search(count, frozen.of_kind(INITIAL),
+                                 frozen.successors)
+        finals = frozen.of_kind(ACTIVITY_FINAL) + frozen.of_kind(FLOW_FINAL)
+        self.finishing = _search(count, finals, frozen.predecessors)
+        self.idom = dominators(frozen)
+        self.pairs = dict()
+        self._issues = list()
+        for i in xrange(count):
+            if not self.reachable[i]:
+                self._issue(UNREACHABLE, i,
+                            "Node is not reachable from an InitialNode")
+            elif not self.finishing[i]:
+                self._issue(NO_FINAL, i,
+                            "No path from node reaches a final node")
+        for i in frozen.of_kind(JOIN):
+            if self.reachable[i]:
+                self._pair(i)
+
+    def _issue(self, kind, i, message):
+        self._issues.append((kind, i, message))
+
+    def _split(self, i):
+        """Nearest fork or decision node dominating node i, or NONE.
+        """
+        kinds = self.frozen.kinds
+        idom = self.idom
+        d = idom[i]
+        while d != NONE:
+            if kinds[d] in (FORK, DECISION):
+                return d
+            if idom[d] == d:
+                break
+            d = idom[d]
+        return NONE
+
+    def _branches(self, fork, join):
+        """Most tokens the fork can send to the join at once.
+
+        Counts the branches of the fork and of the forks nested between fork
+        and join, less the tokens joined by the joins nested there. The
+        nodes between are those reaching join without passing fork, fork
+        dominates them.
+
+        A backward search from join, linear in the nodes and edges between.
+        Run once per paired join, so pairing all joins takes
+        O(j * (n + m)) for j joins in the worst case, when the regions of
+        the joins overlap.
+        """
+        frozen = self.frozen
+        kinds = frozen.kinds
+        reachable = self.reachable
+        branches = len(frozen.outgoing(fork))
+        seen = set([fork, join])
+        stack = [join]
+        while stack:
+            i = stack.pop()
+            for j in frozen.predecessors(i):
+                if j in seen or not reachable[j]:
+                    continue
+                seen.add(j)
+                stack.append(j)
+                if kinds[j] == FORK:
+                    branches += len(frozen.outgoing(j)) - 1
+                elif kinds[j] == JOIN:
+                    branches -= len(frozen.incoming(j)) - 1
+        return branches
+
+    def _pair(self, join):
+        frozen = self.frozen
+        split = self._split(join)
+        if split == NONE:
+            self._issue(JOIN_UNPAIRED, join,
+                        "JoinNode is not preceded by a ForkNode, its inputs "
+                        "can never all arrive")
+        elif frozen.kinds[split] == DECISION:
+            self._issue(JOIN_EXCLUSIVE, join,
+                        "JoinNode inputs are alternatives of DecisionNode "
+                        "'%s', they can never all arrive" % \
+                        frozen.names[split])
+        else:
+            self.pairs[join] = split
+            inputs = len(frozen.incoming(join))
+            branches = self._branches(split, join)
+            if inputs > branches:
+                self._issue(JOIN_OVERFLOW, join,
+                            "JoinNode has %i inputs but its ForkNode '%s' "
+                            "only %i branches, they can never all arrive" % \
+                            (inputs, frozen.names[split], branches))
+
+    @property
+    def issues(self):
+        """Issues as list of Issue objects, with the node elements.
+        """
+        node = self.frozen.node
+        return [Issue(kind, node(i), message) \
+                for kind, i, message in self._issues]
+
+    @property
+    def sound(self):
+        return not self._issues
+
+    def fork_join_pairs(self):
+        """(fork, join) node element pairs.
+        """
+        node = self.frozen.node
+        return [(node(fork), node(join)) \
+                for join, fork in sorted(self.pairs.items())]
+
+    def dominator(self, element):
+        """Immediate dominator of the given node element. None for initial
+        and unreachable nodes.
+        """
+        i = self.frozen.id_of(element)
+        d = self.idom[i]
+        if d == NONE or d == i:
+            return None
+        return self.frozen.node(d)
+
+
+def analyze(activity):
+    """Analyze the structure of activity, or of a FrozenActivity.
+    """
+    return Analysis(activity)
+
+
+def check_soundness(activity):
+    """Raise ModelIllFormedException for the first soundness issue of
+    activity.
+    """
+    issues = Analysis(activity).issues
+    if issues:
+        raise ModelIllFormedException, str(issues[0])
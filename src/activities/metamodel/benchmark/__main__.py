@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+from activities.metamodel.benchmark.runner import main
+
+main()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+import random
+
+from activities.metamodel.builder import ActivityBuilder
+from activities.metamodel.elements import Activity
+from activities.metamodel.elements import ActivityFinalNode
+from activities.metamodel.elements import DecisionNode
+from activities.metamodel.elements import ForkNode
+from activities.metamodel.elements import InitialNode
+from activities.metamodel.elements import JoinNode
+from activities.metamodel.elements import MergeNode
+from activities.metamodel.elements import OpaqueAction
+from activities.metamodel.elements import Package
+from activities.metamodel.elements import PostConstraint
+from activities.metamodel.elements import PreConstraint
+from activities.metamodel.elements import Profile
+from activities.metamodel.elements import Stereotype
+from activities.metamodel.elements import TaggedValue
+
+# chance of a region instead of an action, where nesting allows
+REGION = 0.3
+
+
+class _ActivityGenerator(object):
+    """Generates the nodes and edges of one valid activity.
+
+    The activity is a sequence of blocks from its initial to its final node.
+    A block is an action or a region: a fork or decision node, fanout
+    branches which are sequences of blocks again, and the join or merge node
+    closing them. Regions nest up to depth levels.
+    """
+
+    def __init__(self, builder, profile, nodes, fanout, depth, decisions,
+                 stereotypes, constraints, rand, count=0):
+        self.builder = builder
+        self.profile = profile
+        # node names are numbered on from count, unique within the model
+        self.count = count
+        self.budget = count + nodes
+        self.fanout = fanout
+        self.depth = depth
+        self.decisions = decisions
+        self.stereotypes = stereotypes
+        self.constraints = constraints
+        self.random = rand
+
+    def generate(self):
+        last = self.sequence(self.node('start', InitialNode), self.depth,
+                             reserve=1)
+        self.edge(last, self.node('end', ActivityFinalNode))
+
+    def node(self, prefix, cls):
+        name = '%s%i' % (prefix, self.count)
+        self.count += 1
+        node = cls()
+        node.xmiid = name
+        if cls is OpaqueAction:
+            self.decorate(node)
+        self.builder.add_node(name, node)
+        return name
+
+    def decorate(self, action):
+        if self.random.random() < self.stereotypes:
+            stereotype = Stereotype(profile=self.profile)
+            stereotype['weight'] = TaggedValue(value=str(self.count % 10))
+            action['execution'] = stereotype
+        if self.random.random() < self.constraints:
+            action['pre'] = PreConstraint(specification='True')
+            action['post'] = PostConstraint(specification='True')
+
+    def edge(self, source, target, guard=None):
+        self.builder.add_edge(source, target, guard=guard)
+
+    def remaining(self):
+        return self.budget - self.count
+
+    def sequence(self, source, depth, reserve=0, blocks=None):
+        """Chain blocks after source until the budget, less reserve, is used
+        or the given number of blocks is reached. Returns the last node.
+        """
+        last = source
+        while self.remaining() > reserve and blocks != 0:
+            last = self.block(last, depth, reserve)
+            if blocks is not None:
+                blocks -= 1
+        return last
+
+    def block(self, source, depth, reserve):
+        # a region needs split, join and an action per branch
+        size = 2 + self.fanout
+        if depth > 0 and self.remaining() - reserve >= size \
+           and self.random.random() < REGION:
+            return self.region(source, depth, reserve)
+        action = self.node('action', OpaqueAction)
+        self.edge(source, action)
+        return action
+
+    def region(self, source, depth, reserve):
+        if self.random.random() < self.decisions:
+            split = self.node('decision', DecisionNode)
+            guards = ['else'] + ['x == %i' % i for i in range(1, self.fanout)]
+            join_class = MergeNode
+        else:
+            split = self.node('fork', ForkNode)
+            guards = [None] * self.fanout
+            join_class = JoinNode
+        self.edge(source, split)
+        # keep room for one action per remaining branch and the join
+        ends = list()
+        for i, guard in enumerate(guards):
+            first = self.node('action', OpaqueAction)
+            self.edge(split, first, guard)
+            branches_left = self.fanout - i - 1
+            ends.append(self.sequence(
+                first, depth - 1, reserve=reserve + branches_left + 1,
+                blocks=self.random.randint(0, 2)))
+        join = self.node(join_class is MergeNode and 'merge' or 'join',
+                         join_class)
+        for end in ends:
+            self.edge(end, join)
+        return join
+
+
+def generate(nodes=1000, fanout=2, depth=2, decisions=0.3, stereotypes=0.1,
+             constraints=0.1, activities=1, seed=0):
+    """Generate a valid model of activities with about the given number of
+    nodes each.
+
+    fanout is the number of branches of fork and decision nodes, depth the
+    nesting depth of fork/join and decision/merge regions. decisions is the
+    share of decision regions among the regions, stereotypes and constraints
+    the share of actions with a stereotype or pre- and postconditions. Node
+    names are unique within the model and are used as xmiids too. The same
+    parameters and seed generate the same model.
+    """
+    rand = random.Random(seed)
+    model = Package('benchmark')
+    profile = model['profile'] = Profile()
+    count = 0
+    for i in range(activities):
+        activity = model['activity%i' % i] = Activity()
+        builder = ActivityBuilder(activity)
+        generator = _ActivityGenerator(builder, profile, max(nodes, 2),
+                                       max(fanout, 1), depth, decisions,
+                                       stereotypes, constraints, rand, count)
+        generator.generate()
+        builder.commit()
+        count = generator.count
+    return model
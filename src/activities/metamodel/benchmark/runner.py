@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+import json
+import platform
+import sys
+import time
+from optparse import OptionParser
+
+from activities.metamodel.benchmark.generator import generate
+from activities.metamodel.elements import get_element_by_xmiid
+from activities.metamodel.elements import validate
+from activities.metamodel.interfaces import IAction
+from activities.metamodel.interfaces import IActivity
+from activities.metamodel.interfaces import IActivityEdge
+from activities.metamodel.interfaces import IActivityNode
+from activities.metamodel.interfaces import IDecisionNode
+
+PARAMETERS = ('nodes', 'fanout', 'depth', 'decisions', 'stereotypes',
+              'constraints', 'activities', 'seed')
+
+### SCENARIOS
+# each scenario is run on a generated model and returns the number of
+# operations it did.
+
+def traversal(model):
+    count = 0
+    for activity in model.filtereditems(IActivity):
+        for node in activity.nodes:
+            count += len(node.incoming_edges) + len(node.outgoing_edges)
+    return count
+
+def xmiid_lookup(model):
+    count = 0
+    for activity in model.filtereditems(IActivity):
+        for node in activity.nodes:
+            get_element_by_xmiid(model, node.xmiid)
+            count += 1
+    return count
+
+def filtereditems(model):
+    count = 0
+    for activity in model.filtereditems(IActivity):
+        for iface in (IActivityNode, IActivityEdge, IAction, IDecisionNode):
+            count += len(list(activity.filtereditems(iface)))
+    return count
+
+SCENARIOS = [
+    ('validate', validate),
+    ('traversal', traversal),
+    ('xmiid_lookup', xmiid_lookup),
+    ('filtereditems', filtereditems),
+]
+
+
+def _timed(function, *args, **kw):
+    start = time.time()
+    result = function(*args, **kw)
+    return time.time() - start, result
+
+
+def run(repeat=3, scenarios=None, **parameters):
+    """Generate a model with the given generator parameters and time the
+    scenarios on it. The best of repeat runs is reported, in seconds.
+    """
+    for name in parameters:
+        if name not in PARAMETERS:
+            raise TypeError, u"Unknown parameter %s" % name
+    names = [name for name, function in SCENARIOS]
+    if scenarios is not None:
+        for name in scenarios:
+            if name not in names:
+                raise ValueError, u"Unknown scenario %s" % name
+        names = [name for name in names if name in scenarios]
+    results = dict()
+    best = None
+    for i in range(repeat):
+        seconds, model = _timed(generate, **parameters)
+        if best is None or seconds < best:
+            best = seconds
+    results['construction'] = dict(seconds=best)
+    for name, function in SCENARIOS:
+        if name not in names:
+            continue
+        best = None
+        for i in range(repeat):
+            seconds, operations = _timed(function, model)
+            if best is None or seconds < best:
+                best = seconds
+        results[name] = dict(seconds=best)
+        if operations is not None:
+            results[name]['operations'] = operations
+    activities = list(model.filtereditems(IActivity))
+    return dict(
+        parameters=parameters,
+        repeat=repeat,
+        python=platform.python_version(),
+        platform=platform.platform(),
+        model=dict(
+            activities=len(activities),
+            nodes=sum([len(activity.nodes) for activity in activities]),
+            edges=sum([len(activity.edges) for activity in activities]),
+        ),
+        results=results,
+    )
+
+
+def main(argv=None):
+    parser = OptionParser(
+        usage="%prog [options]",
+        description="Time construction, validation, traversal, xmiid "
+                    "lookup and filtereditems queries on a generated model "
+                    "and write the results as JSON.")
+    parser.add_option('--nodes', type='int', default=1000,
+                      help="nodes per activity [%default]")
+    parser.add_option('--fanout', type='int', default=2,
+                      help="branches per fork and decision [%default]")
+    parser.add_option('--depth', type='int', default=2,
+                      help="nesting depth of regions [%default]")
+    parser.add_option('--decisions', type='float', default=0.3,
+                      help="share of decision regions [%default]")
+    parser.add_option('--stereotypes', type='float', default=0.1,
+                      help="share of actions with stereotype [%default]")
+    parser.add_option('--constraints', type='float', default=0.1,
+                      help="share of actions with constraints [%default]")
+    parser.add_option('--activities', type='int', default=1,
+                      help="number of activities [%default]")
+    parser.add_option('--seed', type='int', default=0,
+                      help="random seed [%default]")
+    parser.add_option('--repeat', type='int', default=3,
+                      help="runs per scenario, the best is reported "
+                           "[%default]")
+    parser.add_option('--scenario', action='append', dest='scenarios',
+                      help="run only this scenario, may be repeated")
+    parser.add_option('-o', '--output', default='-',
+                      help="output file, - for stdout [%default]")
+    options, args = parser.parse_args(argv)
+    if args:
+        parser.error("unexpected arguments")
+    parameters = dict([(name, getattr(options, name)) \
+                       for name in PARAMETERS])
+    try:
+        result = run(repeat=options.repeat, scenarios=options.scenarios,
+                     **parameters)
+    except ValueError, e:
+        parser.error(str(e))
+    data = json.dumps(result, indent=2, sort_keys=True)
+    if options.output == '-':
+        sys.stdout.write(data + '\n')
+        return
+    out = open(options.output, 'w')
+    try:
+        out.write(data + '\n')
+    finally:
+        out.close()
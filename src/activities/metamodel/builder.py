@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+import inspect
+
+from activities.metamodel.elements import ActivityEdge
+from activities.metamodel.elements import revalidate
+from activities.metamodel.interfaces import IActivityEdge
+
+
+class ActivityBuilder(object):
+    """Batch construction of an activity.
+
+    Nodes and edges are collected first and inserted into the activity in one
+    operation on commit. Edge endpoints are given by node name or by the
+    position of the node in the batch, so collecting needs no lookups in the
+    activity. Index maintenance and validation happen once on commit.
+
+    Edges are instances of edge_class, e.g. the compact ActivityEdge.
+    """
+
+    def __init__(self, activity, edge_class=ActivityEdge):
+        self.activity = activity
+        self.edge_class = edge_class
+        self._nodes = list()
+        self._positions = dict()
+        self._edges = list()
+
+    def add_node(self, name, node):
+        """Add a node instance or class to instantiate. Returns the position
+        of the node in the batch.
+        """
+        if inspect.isclass(node):
+            node = node()
+        self._positions[name] = len(self._nodes)
+        self._nodes.append((name, node))
+        return len(self._nodes) - 1
+
+    def add_nodes(self, specs):
+        """Add (name, node) pairs.
+        """
+        for name, node in specs:
+            self.add_node(name, node)
+
+    def add_edge(self, source, target, guard=None, name=None):
+        """Add an edge between the nodes given by name or batch position.
+
+        Edges without name are named by their number within the activity,
+        like '1', '2', ...
+        """
+        self._edges.append((name, source, target, guard))
+
+    def add_edges(self, edges):
+        """Add (source, target[, guard[, name]]) tuples.
+        """
+        for edge in edges:
+            self.add_edge(*edge)
+
+    def _node(self, ref):
+        if isinstance(ref, (int, long)):
+            return self._nodes[ref][1]
+        position = self._positions.get(ref)
+        if position is not None:
+            return self._nodes[position][1]
+        return self.activity[ref]
+
+    def commit(self, validate=False):
+        """Insert the collected nodes and edges into the activity.
+
+        Either all or none are inserted. If validate is True, the activity
+        is revalidated afterwards.
+        """
+        items = list(self._nodes)
+        taken = set(self.activity.keys())
+        taken.update(self._positions.keys())
+        taken.update([edge[0] for edge in self._edges])
+        number = self.activity.filteredcount(IActivityEdge)
+        for name, source, target, guard in self._edges:
+            if name is None:
+                number += 1
+                while str(number) in taken:
+                    number += 1
+                name = str(number)
+            edge = self.edge_class(source=self._node(source),
+                                   target=self._node(target),
+                                   guard=guard)
+            items.append((name, edge))
+        self.activity._insert_many(items)
+        self._nodes = list()
+        self._positions = dict()
+        self._edges = list()
+        if validate:
+            revalidate(self.activity)
+        return self.activity
+
+
+def build(activity, nodes=(), edges=(), validate=False,
+          edge_class=ActivityEdge):
+    """Insert nodes given as (name, node) and edges given as
+    (source, target[, guard[, name]]) into activity in one operation.
+    """
+    builder = ActivityBuilder(activity, edge_class=edge_class)
+    builder.add_nodes(nodes)
+    builder.add_edges(edges)
+    return builder.commit(validate=validate)
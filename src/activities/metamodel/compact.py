@@ -0,0 +1,487 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+import uuid
+from zodict.node import Node
+from zodict.zodict import zodict
+from zope.interface import implements
+
+from activities.metamodel import elements
+from activities.metamodel.elements import ModelIllFormedException
+from activities.metamodel.elements import ModelNode
+from activities.metamodel.elements import _check_abstract
+from activities.metamodel.elements import _check_activity_edge
+from activities.metamodel.elements import _check_activity_node
+from activities.metamodel.elements import _check_decision_node
+from activities.metamodel.elements import _check_final_node
+from activities.metamodel.elements import _check_fork_node
+from activities.metamodel.elements import _check_initial_node
+from activities.metamodel.elements import _check_join_node
+from activities.metamodel.elements import _check_merge_node
+from activities.metamodel.elements import _metamodel_interfaces
+from activities.metamodel.elements import _shared
+from activities.metamodel.interfaces import IActivity
+from activities.metamodel.interfaces import IActivityEdge
+from activities.metamodel.interfaces import IActivityFinalNode
+from activities.metamodel.interfaces import IActivityNode
+from activities.metamodel.interfaces import IControlNode
+from activities.metamodel.interfaces import IDecisionNode
+from activities.metamodel.interfaces import IFinalNode
+from activities.metamodel.interfaces import IFlowFinalNode
+from activities.metamodel.interfaces import IForkNode
+from activities.metamodel.interfaces import IInitialNode
+from activities.metamodel.interfaces import IJoinNode
+from activities.metamodel.interfaces import IMergeNode
+from activities.metamodel.interfaces import IProfile
+from activities.metamodel.interfaces import IStereotype
+from activities.metamodel.interfaces import IStereotypeApplication
+from activities.metamodel.interfaces import ITaggedValue
+
+# Compact leaf elements. They implement the interfaces of the element classes
+# of the same name, but are plain objects with __slots__ instead of zodict
+# nodes: no ordered dict, no instance __dict__, no own uuid index. They can't
+# have children, i.e. no stereotypes or constraints.
+#
+# Accessors without super calls are shared with the element classes, the
+# model checks call the check functions of elements.py.
+
+class CompactNode(object):
+    """Slotted leaf, with the read API of an empty node.
+    """
+    __slots__ = ('__name__', '__parent__', '_index', '_uuid', '_xmiid')
+
+    abstract = True
+
+    def __init__(self, name=None):
+        self.__name__ = name
+        self.__parent__ = None
+        self._index = None
+        self._uuid = uuid.uuid4()
+        self._xmiid = None
+
+    def get_uuid(self):
+        return self._uuid
+    def set_uuid(self, value):
+        index = self._index
+        if index is not None:
+            if index.get(value, self) is not self:
+                raise ValueError(
+                    u"Given uuid was already used for another Node")
+            if index.get(self._uuid) is self:
+                del index[self._uuid]
+            index[value] = self
+        self._uuid = value
+    uuid = property(get_uuid, set_uuid)
+
+    get_xmiid = _shared(ModelNode, 'get_xmiid')
+    set_xmiid = _shared(ModelNode, 'set_xmiid')
+    xmiid = _shared(ModelNode, 'xmiid')
+    _model_root = _shared(ModelNode, '_model_root')
+
+    path = _shared(Node, 'path')
+    root = _shared(Node, 'root')
+    __repr__ = _shared(Node, '__repr__')
+    __str__ = __repr__
+
+    def node(self, uuid):
+        if self._index is None:
+            return None
+        return self._index.get(uuid)
+
+    ### no children
+    def __len__(self):
+        return 0
+
+    def __iter__(self):
+        return iter(())
+
+    def __contains__(self, key):
+        return False
+
+    def __getitem__(self, key):
+        raise KeyError(key)
+
+    def __setitem__(self, key, val):
+        raise ValueError(u"Compact elements can't have children")
+
+    def get(self, key, default=None):
+        return default
+
+    def keys(self):
+        return list()
+
+    def values(self):
+        return list()
+
+    def items(self):
+        return list()
+
+    def filtereditems(self, interface):
+        return iter(())
+
+    def filteredcount(self, interface):
+        return 0
+
+    @property
+    def stereotypes(self):
+        return list()
+
+    def check_model_constraints(self):
+        _check_abstract(self)
+
+
+class CompactActivityNode(CompactNode):
+    implements(IActivityNode)
+    __slots__ = ('__weakref__',)
+
+    activity = _shared(elements.ActivityNode, 'activity')
+    incoming_edges = _shared(elements.ActivityNode, 'incoming_edges')
+    outgoing_edges = _shared(elements.ActivityNode, 'outgoing_edges')
+    _edges = _shared(elements.ActivityNode, '_edges')
+    _in_degree = _shared(elements.ActivityNode, '_in_degree')
+    _out_degree = _shared(elements.ActivityNode, '_out_degree')
+
+    def check_model_constraints(self):
+        super(CompactActivityNode, self).check_model_constraints()
+        _check_activity_node(self)
+
+
+class CompactControlNode(CompactActivityNode):
+    implements(IControlNode)
+    __slots__ = ()
+
+
+class CompactFinalNode(CompactControlNode):
+    implements(IFinalNode)
+    __slots__ = ()
+
+    def check_model_constraints(self):
+        super(CompactFinalNode, self).check_model_constraints()
+        _check_final_node(self)
+
+
+class InitialNode(CompactControlNode):
+    implements(IInitialNode)
+    __slots__ = ()
+    abstract = False
+
+    def check_model_constraints(self):
+        super(InitialNode, self).check_model_constraints()
+        _check_initial_node(self)
+
+
+class ActivityFinalNode(CompactFinalNode):
+    implements(IActivityFinalNode)
+    __slots__ = ()
+    abstract = False
+
+
+class FlowFinalNode(CompactFinalNode):
+    implements(IFlowFinalNode)
+    __slots__ = ()
+    abstract = False
+
+
+class DecisionNode(CompactControlNode):
+    implements(IDecisionNode)
+    __slots__ = ()
+    abstract = False
+
+    decide = _shared(elements.DecisionNode, 'decide')
+
+    def check_model_constraints(self):
+        super(DecisionNode, self).check_model_constraints()
+        _check_decision_node(self)
+
+
+class ForkNode(CompactControlNode):
+    implements(IForkNode)
+    __slots__ = ()
+    abstract = False
+
+    def check_model_constraints(self):
+        super(ForkNode, self).check_model_constraints()
+        _check_fork_node(self)
+
+
+class JoinNode(CompactControlNode):
+    implements(IJoinNode)
+    __slots__ = ()
+    abstract = False
+
+    def check_model_constraints(self):
+        super(JoinNode, self).check_model_constraints()
+        _check_join_node(self)
+
+
+class MergeNode(CompactControlNode):
+    implements(IMergeNode)
+    __slots__ = ()
+    abstract = False
+
+    def check_model_constraints(self):
+        super(MergeNode, self).check_model_constraints()
+        _check_merge_node(self)
+
+
+class ActivityEdge(CompactNode):
+    implements(IActivityEdge)
+    __slots__ = ('source_uuid', 'target_uuid', '_v_source', '_v_target',
+                 '_guard', '_v_guard_code')
+    abstract = False
+
+    def __init__(self, name=None, source=None, target=None, guard=None):
+        super(ActivityEdge, self).__init__(name)
+        self.source_uuid = None
+        self.target_uuid = None
+        self._v_source = None
+        self._v_target = None
+        self._v_guard_code = None
+        if IActivityNode.providedBy(source):
+            self.source = source
+        if IActivityNode.providedBy(target):
+            self.target = target
+        self.guard = guard
+
+    activity = _shared(elements.ActivityEdge, 'activity')
+    _rewire = _shared(elements.ActivityEdge, '_rewire')
+    _resolve = _shared(elements.ActivityEdge, '_resolve')
+    get_source = _shared(elements.ActivityEdge, 'get_source')
+    set_source = _shared(elements.ActivityEdge, 'set_source')
+    source = _shared(elements.ActivityEdge, 'source')
+    get_target = _shared(elements.ActivityEdge, 'get_target')
+    set_target = _shared(elements.ActivityEdge, 'set_target')
+    target = _shared(elements.ActivityEdge, 'target')
+    get_guard = _shared(elements.ActivityEdge, 'get_guard')
+    set_guard = _shared(elements.ActivityEdge, 'set_guard')
+    guard = _shared(elements.ActivityEdge, 'guard')
+    is_else = _shared(elements.ActivityEdge, 'is_else')
+    guard_code = _shared(elements.ActivityEdge, 'guard_code')
+    evaluate_guard = _shared(elements.ActivityEdge, 'evaluate_guard')
+
+    def check_model_constraints(self):
+        super(ActivityEdge, self).check_model_constraints()
+        _check_activity_edge(self)
+
+
+class TaggedValue(CompactNode):
+    implements(ITaggedValue)
+    __slots__ = ('_value',)
+
+    def __init__(self, name=None, value=None):
+        super(TaggedValue, self).__init__(name)
+        self._value = value
+
+    get_value = _shared(elements.TaggedValue, 'get_value')
+    set_value = _shared(elements.TaggedValue, 'set_value')
+    value = _shared(elements.TaggedValue, 'value')
+
+
+class StereotypeApplication(CompactNode):
+    """Stereotype applied by reference to a stereotype defined in a profile,
+    see Profile.add_stereotype.
+
+    Only overridden tagged values are stored, the others are the tagged
+    values of the definition, shared by all its applications. Tagged values
+    are no children: the application is a leaf of the model, the tagged
+    values are read by name, taggedvalues or filtereditems.
+    """
+    implements(IStereotypeApplication)
+    __slots__ = ('definition', '_overrides')
+    abstract = False
+
+    def __init__(self, name=None, definition=None, overrides=None):
+        super(StereotypeApplication, self).__init__(name)
+        try:
+            assert(IStereotype.providedBy(definition))
+        except AssertionError:
+            raise ModelIllFormedException,\
+                  str(self) +  " " +\
+                  u"StereotypeApplication must have a reference to the "\
+                  u"Stereotype it applies"
+        self.definition = definition
+        self._overrides = None
+        if overrides:
+            for key, value in overrides.items():
+                self.override(key, value)
+
+    @property
+    def profile(self):
+        return self.definition.profile
+
+    @property
+    def overrides(self):
+        if not self._overrides:
+            return dict()
+        return dict([(key, taggedvalue.value) \
+                     for key, taggedvalue in self._overrides.items()])
+
+    def _overridden(self):
+        if not self._overrides:
+            return list()
+        return self._overrides.values()
+
+    def override(self, key, value):
+        """Set tagged value key of this application to value.
+        """
+        if not ITaggedValue.providedBy(self.definition.get(key)):
+            raise KeyError(key)
+        if self._overrides is None:
+            self._overrides = dict()
+        taggedvalue = self._overrides.get(key)
+        if taggedvalue is not None:
+            # reindexed by the tagged value
+            taggedvalue.value = value
+            return
+        taggedvalue = TaggedValue(key, value)
+        taggedvalue.__parent__ = self
+        self._overrides[key] = taggedvalue
+        root = self._model_root
+        if root is not None:
+            root._index_stereotyped(taggedvalue)
+
+    def reset(self, key):
+        """Use the value of the definition for tagged value key again.
+        """
+        if not self._overrides or key not in self._overrides:
+            return
+        root = self._model_root
+        if root is not None:
+            root._unindex_stereotyped(self._overrides[key])
+        del self._overrides[key]
+
+    ### tagged values
+    @property
+    def taggedvalues(self):
+        overrides = self._overrides or {}
+        return [overrides.get(taggedvalue.__name__, taggedvalue) \
+                for taggedvalue in self.definition.filtereditems(ITaggedValue)]
+
+    def __contains__(self, key):
+        return ITaggedValue.providedBy(self.definition.get(key))
+
+    def __getitem__(self, key):
+        taggedvalue = self.get(key)
+        if taggedvalue is None:
+            raise KeyError(key)
+        return taggedvalue
+
+    def get(self, key, default=None):
+        if self._overrides and key in self._overrides:
+            return self._overrides[key]
+        taggedvalue = self.definition.get(key)
+        if not ITaggedValue.providedBy(taggedvalue):
+            return default
+        return taggedvalue
+
+    def filtereditems(self, interface):
+        return iter([taggedvalue for taggedvalue in self.taggedvalues \
+                     if interface.providedBy(taggedvalue)])
+
+    def filteredcount(self, interface):
+        return len(list(self.filtereditems(interface)))
+
+    def check_model_constraints(self):
+        super(StereotypeApplication, self).check_model_constraints()
+        try:
+            assert IProfile.providedBy(self.definition.__parent__)
+        except AssertionError:
+            raise ModelIllFormedException,\
+                  str(self) +  " " +\
+                  u"StereotypeApplication must apply a Stereotype defined "\
+                  u"in a Profile"
+        try:
+            assert self.__name__ == self.definition.__name__
+        except AssertionError:
+            raise ModelIllFormedException,\
+                  str(self) +  " " +\
+                  u"StereotypeApplication must be named like the Stereotype "\
+                  u"it applies"
+
+
+def apply_stereotype(element, definition, overrides=None):
+    """Apply the stereotype definition to element, overriding the tagged
+    values given in the dict overrides. Returns the application.
+    """
+    application = StereotypeApplication(definition=definition,
+                                        overrides=overrides)
+    element[definition.__name__] = application
+    return application
+
+
+# element class -> compact class
+COMPACT = {
+    elements.InitialNode: InitialNode,
+    elements.ActivityFinalNode: ActivityFinalNode,
+    elements.FlowFinalNode: FlowFinalNode,
+    elements.DecisionNode: DecisionNode,
+    elements.ForkNode: ForkNode,
+    elements.JoinNode: JoinNode,
+    elements.MergeNode: MergeNode,
+    elements.ActivityEdge: ActivityEdge,
+    elements.TaggedValue: TaggedValue,
+}
+
+# compact class -> element class
+EXPANDED = dict([(compact, cls) for cls, compact in COMPACT.items()])
+
+
+def _convert(node):
+    compact = COMPACT[node.__class__]()
+    compact._uuid = node.uuid
+    compact._xmiid = node.xmiid
+    if IActivityEdge.providedBy(node):
+        compact.source_uuid = node.source_uuid
+        compact.target_uuid = node.target_uuid
+        compact.guard = node.guard
+    elif ITaggedValue.providedBy(node):
+        compact.value = node.value
+    return compact
+
+
+def compact(node):
+    """Replace the leaf children of node by compact elements in place.
+
+    Children with children of their own, like stereotypes, are kept. The
+    converted elements keep name, position, uuid and xmiid. Returns the
+    number of elements replaced.
+    """
+    root = node._model_root
+    index = node._index
+    replaced = list()
+    for key, val in node.items():
+        if val.__class__ not in COMPACT or len(val):
+            continue
+        leaf = _convert(val)
+        if root is not None:
+            root._unindex_stereotyped(val)
+        # replace in place, keeping the order of the children and buckets
+        zodict.__setitem__(node, key, leaf)
+        for iface in _metamodel_interfaces(leaf):
+            node._buckets[iface][key] = leaf
+        leaf.__name__ = key
+        leaf.__parent__ = node
+        leaf._index = index
+        index[leaf._uuid] = leaf
+        if root is not None:
+            if leaf._xmiid is not None:
+                root._xmiids[leaf._xmiid] = leaf
+            root._index_stereotyped(leaf)
+        replaced.append(leaf)
+    if replaced and IActivity.providedBy(node):
+        # the adjacency index holds the replaced edges
+        node._reindex()
+        # edges kept must not keep resolving to the replaced nodes
+        for leaf in replaced:
+            if IActivityNode.providedBy(leaf):
+                for edge in node._adjacent_edges('_incoming', leaf):
+                    edge._v_target = None
+                for edge in node._adjacent_edges('_outgoing', leaf):
+                    edge._v_source = None
+    return len(replaced)
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+import marshal
+import struct
+import uuid
+
+from activities.metamodel.elements import _subtree
+from activities.metamodel.elements import get_element_by_xmiid
+from activities.metamodel.interfaces import IActivity
+from activities.metamodel.interfaces import IActivityEdge
+from activities.metamodel.interfaces import IConstraint
+from activities.metamodel.interfaces import IStereotype
+from activities.metamodel.interfaces import IStereotypeApplication
+from activities.metamodel.interfaces import ITaggedValue
+from activities.metamodel.snapshot import CLASSES
+from activities.metamodel.snapshot import _CODES
+
+# Structural diff of two versions of a model, and patching a model with it.
+#
+# Elements are matched by key, UUID or XMIID. With XMIID, elements without
+# xmiid are matched by their name within the matched parent. The root
+# packages are always matched. Elements matched, but with another class,
+# name or parent, or applying another stereotype or profile, are replaced.
+#
+# A change set holds, with elements and references given by their key:
+# removed: keys of the removed elements, topmost only
+# added:   (parent key, record) of the added elements, topmost only. A record
+#          is (class, name, uuid bytes, attributes, child records), uuid
+#          bytes are None for XMIID change sets.
+# modified: (key, attributes) of the changed attributes of matched elements
+#
+# Attributes are xmiid and, depending on the class:
+#   ActivityEdge -> source, target, guard
+#   Constraint   -> specification
+#   Stereotype   -> profile
+#   StereotypeApplication -> definition, overrides
+#   TaggedValue  -> value
+# Added elements are appended to their parent, the order of children is not
+# compared.
+UUID = 'uuid'
+XMIID = 'xmiid'
+
+MAGIC = 'AMDF'
+VERSION = 1
+HEADER = struct.Struct('>4sHB')
+
+
+class ChangeSet(object):
+    """Changes between two versions of a model, see diff.
+    """
+
+    def __init__(self, key, removed, added, modified):
+        self.key = key
+        self.removed = removed
+        self.added = added
+        self.modified = modified
+
+    def __len__(self):
+        return len(self.removed) + len(self.added) + len(self.modified)
+
+    def __repr__(self):
+        return '<ChangeSet %i removed, %i added, %i modified>' % (
+            len(self.removed), len(self.added), len(self.modified))
+
+
+def _keys(model, key):
+    """Keys of model and all nodes below it, by node id. The root has key
+    None.
+    """
+    keys = {id(model): None}
+    for node in _subtree(model):
+        if node is model:
+            continue
+        if key == UUID:
+            keys[id(node)] = node.uuid.bytes
+            continue
+        xmiid = node.xmiid
+        if xmiid is None:
+            keys[id(node)] = (keys[id(node.__parent__)], node.__name__)
+        else:
+            keys[id(node)] = xmiid
+    return keys
+
+
+def _reference(keys, node):
+    if node is None:
+        return None
+    return keys.get(id(node))
+
+
+def _attributes(node, keys):
+    attributes = dict(xmiid=node.xmiid)
+    if IActivityEdge.providedBy(node):
+        attributes['source'] = _reference(keys, node.source)
+        attributes['target'] = _reference(keys, node.target)
+        attributes['guard'] = node.guard
+    elif IConstraint.providedBy(node):
+        attributes['specification'] = node.specification
+    elif IStereotypeApplication.providedBy(node):
+        attributes['definition'] = _reference(keys, node.definition)
+        attributes['overrides'] = node.overrides
+    elif IStereotype.providedBy(node):
+        attributes['profile'] = _reference(keys, node.profile)
+    elif ITaggedValue.providedBy(node):
+        attributes['value'] = node.value
+    return attributes
+
+
+def _code(node):
+    try:
+        return _CODES[node.__class__]
+    except KeyError:
+        raise ValueError, u"Can't diff %s, unknown class" % str(node)
+
+
+def _record(node, keys, key):
+    node_uuid = None
+    if key == UUID:
+        node_uuid = node.uuid.bytes
+    return (_code(node), node.__name__, node_uuid, _attributes(node, keys),
+            [_record(child, keys, key) for child in node.values()])
+
+
+def diff(old, new, key=UUID):
+    """Changes turning model old into model new, as ChangeSet.
+
+    Elements are matched by key, UUID or XMIID. Match by UUID for versions
+    derived from each other, e.g. by snapshots, and by XMIID for versions
+    read from XMI.
+    """
+    if key not in (UUID, XMIID):
+        raise ValueError, u"Unknown key %s" % key
+    old_keys = _keys(old, key)
+    new_keys = _keys(new, key)
+    old_nodes = dict([(old_keys[id(node)], node) for node in _subtree(old)])
+    # new node id -> old node, for the matched nodes
+    matched = {id(new): old}
+    for node in _subtree(new):
+        if node is new or id(node.__parent__) not in matched:
+            continue
+        other = old_nodes.get(new_keys[id(node)])
+        if other is not None \
+           and other.__parent__ is matched[id(node.__parent__)] \
+           and other.__name__ == node.__name__ \
+           and _code(other) == _code(node):
+            matched[id(node)] = other
+    # stereotypes applying another or a replaced profile or definition are
+    # replaced, with their tagged values
+    for node in _subtree(new):
+        if id(node) not in matched or not IStereotype.providedBy(node):
+            continue
+        other = matched[id(node)]
+        if IStereotypeApplication.providedBy(node):
+            reference, other_reference = node.definition, other.definition
+        else:
+            reference, other_reference = node.profile, other.profile
+        if reference is not None and (id(reference) not in matched \
+           or matched[id(reference)] is not other_reference):
+            for sub in _subtree(node):
+                matched.pop(id(sub), None)
+    added = list()
+    modified = list()
+    for node in _subtree(new):
+        if node is new or id(node.__parent__) not in matched:
+            continue
+        if id(node) not in matched:
+            added.append((new_keys[id(node.__parent__)],
+                          _record(node, new_keys, key)))
+            continue
+        attributes = _attributes(node, new_keys)
+        other_attributes = _attributes(matched[id(node)], old_keys)
+        changes = dict([(name, value) \
+                        for name, value in attributes.items() \
+                        if other_attributes.get(name) != value])
+        if IActivityEdge.providedBy(node):
+            # endpoints replaced are rewired, even if their key is the same
+            for name in ('source', 'target'):
+                endpoint = getattr(node, name)
+                if endpoint is not None and id(endpoint) not in matched:
+                    changes[name] = attributes[name]
+        if changes:
+            modified.append((new_keys[id(node)], changes))
+    kept = set([id(other) for other in matched.values()])
+    removed = [old_keys[id(node)] for node in _subtree(old) \
+               if id(node) not in kept and id(node.__parent__) in kept]
+    return ChangeSet(key, removed, added, modified)
+
+
+class _Patch(object):
+    """Applies a change set to a model.
+    """
+
+    def __init__(self, model, changes):
+        self.model = model
+        self.key = changes.key
+        self.changes = changes
+        # added edges, wired once all elements are added
+        self.edges = list()
+        # added stereotypes and applications, added once their profiles
+        # and definitions are
+        self.stereotypes = list()
+        self.applications = list()
+
+    def resolve(self, key):
+        if key is None:
+            return self.model
+        if self.key == UUID:
+            node = self.model.node(uuid.UUID(bytes=key))
+        elif isinstance(key, tuple):
+            node = self.resolve(key[0]).get(key[1])
+        else:
+            node = get_element_by_xmiid(self.model, key)
+        if node is None:
+            raise ValueError, u"Can't patch, element %r not found" % (key,)
+        return node
+
+    def apply(self):
+        changes = self.changes
+        for key in changes.removed:
+            node = self.resolve(key)
+            del node.__parent__[node.__name__]
+        for key, record in changes.added:
+            self.add(self.resolve(key), record)
+        for parent, record in self.stereotypes + self.applications:
+            self.add(parent, record, deferred=False)
+        for edge, attributes in self.edges:
+            self.wire(edge, attributes)
+        for key, attributes in changes.modified:
+            self.modify(self.resolve(key), attributes)
+
+    def add(self, parent, record, deferred=True):
+        code, name, node_uuid, attributes, children = record
+        cls = CLASSES[code]
+        if IStereotypeApplication.implementedBy(cls):
+            if deferred:
+                self.applications.append((parent, record))
+                return
+            node = cls(definition=self.resolve(attributes['definition']))
+        elif IStereotype.implementedBy(cls):
+            if deferred:
+                self.stereotypes.append((parent, record))
+                return
+            node = cls(profile=self.resolve(attributes['profile']))
+        elif IActivityEdge.implementedBy(cls):
+            node = cls(guard=attributes['guard'])
+            self.edges.append((node, attributes))
+        elif IConstraint.implementedBy(cls):
+            node = cls(specification=attributes['specification'])
+        elif ITaggedValue.implementedBy(cls):
+            node = cls(value=attributes['value'])
+        else:
+            node = cls()
+        if node_uuid is not None:
+            # registered in the index of the model on insertion
+            node._uuid = uuid.UUID(bytes=node_uuid)
+        node._xmiid = attributes['xmiid']
+        parent[name] = node
+        if IStereotypeApplication.providedBy(node):
+            for key, value in attributes['overrides'].items():
+                node.override(key, value)
+        for child in children:
+            self.add(node, child, deferred=deferred)
+
+    def wire(self, edge, attributes):
+        if attributes.get('source') is not None:
+            edge.source = self.resolve(attributes['source'])
+        if attributes.get('target') is not None:
+            edge.target = self.resolve(attributes['target'])
+
+    def modify(self, node, attributes):
+        for name, value in attributes.items():
+            if name in ('source', 'target'):
+                continue
+            if name == 'overrides':
+                for key in node.overrides:
+                    if key not in value:
+                        node.reset(key)
+                for key, override in value.items():
+                    node.override(key, override)
+                continue
+            setattr(node, name, value)
+        self.wire(node, attributes)
+        # changed elements are checked again by revalidate
+        activity = node.__parent__
+        while activity is not None and not IActivity.providedBy(activity):
+            activity = activity.__parent__
+        if activity is not None:
+            activity._mark([node])
+
+
+def patch(model, changes):
+    """Apply the ChangeSet changes to model in place.
+
+    model must match the old model of the diff. Use revalidate afterwards,
+    it checks only the elements affected by the patch if the model was
+    validated before.
+    """
+    _Patch(model, changes).apply()
+    return model
+
+
+def dumps(changes):
+    """ChangeSet as string.
+    """
+    header = HEADER.pack(MAGIC, VERSION, marshal.version)
+    return header + marshal.dumps(
+        (changes.key, changes.removed, changes.added, changes.modified),
+        marshal.version)
+
+
+def loads(data):
+    """ChangeSet from string.
+    """
+    try:
+        magic, version, marshal_version = HEADER.unpack_from(data)
+    except struct.error:
+        magic = None
+    if magic != MAGIC:
+        raise ValueError, u"Not a change set"
+    if version != VERSION:
+        raise ValueError, u"Unsupported change set version %s" % version
+    if marshal_version > marshal.version:
+        raise ValueError, \
+              u"Unsupported marshal version %s" % marshal_version
+    key, removed, added, modified = marshal.loads(data[HEADER.size:])
+    return ChangeSet(key, removed, added, modified)
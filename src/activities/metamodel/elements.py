@@ -7,8 +7,18 @@
 __author__ = """Johannes Raggam <johannes@raggam.co.at>"""
 __docformat__ = 'plaintext'
 
+import inspect
+import multiprocessing
+import os
+import weakref
+from odict import odict
 from zodict.node import Node
+from zodict.zodict import zodict
+from zope.interface import implementedBy
 from zope.interface import implements
+from zope.interface import providedBy
+from zope.location import LocationIterator
+from activities.metamodel import interfaces
 from activities.metamodel.interfaces import ActivitiesException
 from activities.metamodel.interfaces import IElement
 
@@ -34,66 +44,339 @@ from activities.metamodel.interfaces import IPostConstraint
 from activities.metamodel.interfaces import IPackage
 from activities.metamodel.interfaces import IProfile
 from activities.metamodel.interfaces import IStereotype
+from activities.metamodel.interfaces import IStereotypeApplication
 from activities.metamodel.interfaces import ITaggedValue
 
-#from persistent import Persistent
-
 ### HELPER CLASSES
 class ModelIllFormedException(ActivitiesException):
     pass
 
 
+# guard marking the default branch of a decision
+ELSE = 'else'
+
+def _compile(expression, filename):
+    return compile(expression.strip(), filename, 'eval')
+
+def _evaluate(code, context):
+    if context is None:
+        context = dict()
+    return eval(code, dict(), context)
+
+
+def _shared(cls, name):
+    """Attribute name defined by cls, to be shared with classes not
+    deriving from it, e.g. the compact elements and the views of stores.
+    """
+    return cls.__dict__[name]
+
+
+def _subtree(node):
+    """Iterate node and all nodes below it, whatever type they are.
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        children = node.values()
+        children.reverse()
+        stack.extend(children)
+
+
+_bucket_interfaces = dict()
+
+def _metamodel_interfaces(node):
+    """The metamodel interfaces provided by node.
+    """
+    spec = providedBy(node)
+    try:
+        return _bucket_interfaces[spec]
+    except KeyError:
+        ifaces = tuple([iface for iface in spec.flattened() \
+                        if iface.__module__ == interfaces.__name__])
+        _bucket_interfaces[spec] = ifaces
+        return ifaces
+
+
+class ModelNode(Node):
+    """Base class of all metamodel nodes.
+
+    Keeps the children bucketed by the metamodel interfaces they provide, so
+    filtereditems only touches matching children. Keeps the model wide
+    indexes held by the root package up to date when nodes are inserted,
+    deleted or changed.
+
+    Interfaces directly provided by a child after its insertion are not
+    reflected in the buckets.
+    """
+    _xmiid = None
+
+    def __init__(self, name=None):
+        # metamodel interface -> odict of children providing it
+        self._buckets = dict()
+        super(ModelNode, self).__init__(name)
+
+    def __setitem__(self, key, val):
+        replaced = key in self
+        if replaced:
+            self._detached(self[key])
+        self._insert(key, val)
+        if replaced:
+            # keep the buckets in the order of the children
+            self._rebucket()
+        else:
+            self._bucket(key, val)
+        self._attached([val])
+
+    def _insert(self, key, val):
+        # zodict's Node.__setitem__, without its linear scan over the keys of
+        # the uuid index
+        if inspect.isclass(val):
+            raise ValueError(u"It isn't allowed to use classes as values.")
+        if val.uuid in self._index:
+            raise ValueError(u"Node with uuid already exists")
+        val.__name__ = key
+        val.__parent__ = self
+        val._index = self._index
+        self._index[val.uuid] = val
+        zodict.__setitem__(self, key, val)
+
+    def _insert_many(self, items):
+        """Insert (key, node) pairs in one operation.
+
+        Keys and uuids are checked up front, so either all or no nodes are
+        inserted. The bookkeeping is done once for all nodes.
+        """
+        keys = set()
+        uuids = set()
+        for key, val in items:
+            if key in self or key in keys:
+                raise ValueError(u"Key already exists: %s" % key)
+            if val.uuid in self._index or val.uuid in uuids:
+                raise ValueError(u"Node with uuid already exists")
+            keys.add(key)
+            uuids.add(val.uuid)
+        for key, val in items:
+            self._insert(key, val)
+            self._bucket(key, val)
+        self._attached([val for key, val in items])
+
+    def _bucket(self, key, val):
+        buckets = self._buckets
+        for iface in _metamodel_interfaces(val):
+            bucket = buckets.get(iface)
+            if bucket is None:
+                bucket = buckets[iface] = odict()
+            bucket[key] = val
+
+    def __delitem__(self, key):
+        val = self[key]
+        self._detached(val)
+        super(ModelNode, self).__delitem__(key)
+        for iface in _metamodel_interfaces(val):
+            bucket = self._buckets[iface]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[iface]
+        activity = self._tracking_activity
+        if activity is not None:
+            activity._mark([self])
+
+    @property
+    def _tracking_activity(self):
+        """The validated activity containing self, which records changes for
+        revalidation.
+        """
+        node = self
+        while node is not None:
+            if IActivity.providedBy(node):
+                if node._validated:
+                    return node
+                return None
+            node = node.__parent__
+        return None
+
+    def _rebucket(self):
+        self._buckets = dict()
+        for key, val in self.items():
+            for iface in _metamodel_interfaces(val):
+                self._buckets.setdefault(iface, odict())[key] = val
+
+    def filtereditems(self, interface):
+        if interface.__module__ != interfaces.__name__:
+            return super(ModelNode, self).filtereditems(interface)
+        bucket = self._buckets.get(interface)
+        if bucket is None:
+            return iter(())
+        return iter(bucket.values())
+
+    def filteredcount(self, interface):
+        """Number of children providing interface.
+        """
+        if interface.__module__ != interfaces.__name__:
+            return len(list(self.filtereditems(interface)))
+        bucket = self._buckets.get(interface)
+        if bucket is None:
+            return 0
+        return len(bucket)
+
+    @property
+    def _model_root(self):
+        """The root package of the model, if self is attached to one.
+
+        zodict does not reset __parent__ on deletion, so the chain of parents
+        is verified to still contain self.
+        """
+        node = self
+        parent = node.__parent__
+        while parent is not None:
+            if parent.get(node.__name__) is not node:
+                return None
+            node = parent
+            parent = node.__parent__
+        if IPackage.providedBy(node):
+            return node
+        return None
+
+    def _attached(self, nodes):
+        index = self._index
+        root = self._model_root
+        activity = self._tracking_activity
+        for node in nodes:
+            for sub in _subtree(node):
+                if sub is not node:
+                    # zodict only registers node itself in the uuid index,
+                    # not the nodes already contained in it.
+                    sub._index = index
+                    index[sub.uuid] = sub
+                if activity is not None:
+                    activity._mark([sub])
+                if root is None:
+                    continue
+                xmiid = getattr(sub, 'xmiid', None)
+                if xmiid is not None:
+                    root._xmiids[xmiid] = sub
+                root._index_stereotyped(sub)
+
+    def _detached(self, node):
+        root = self._model_root
+        if root is None:
+            return
+        xmiids = root._xmiids
+        for sub in _subtree(node):
+            xmiid = getattr(sub, 'xmiid', None)
+            if xmiid is not None and xmiids.get(xmiid) is sub:
+                del xmiids[xmiid]
+            root._unindex_stereotyped(sub)
+
+    def get_xmiid(self):
+        return self._xmiid
+    def set_xmiid(self, xmiid):
+        root = self._model_root
+        if root is not None:
+            if root._xmiids.get(self._xmiid) is self:
+                del root._xmiids[self._xmiid]
+            if xmiid is not None:
+                root._xmiids[xmiid] = self
+        self._xmiid = xmiid
+    xmiid = property(get_xmiid, set_xmiid)
+
+
 ### ABSTRACT BASE CLASSES
-# class Element(Persistent):
-class Element(Node):
-    # TODO: make superclass (Persistent or not...) of element provided by an
-    # Interface factory to inject this dependency from outside.
+def _check_abstract(node):
+    try:
+        assert(not node.abstract)
+    except AssertionError:
+        raise ModelIllFormedException,\
+              str(node) +  " " +\
+              "Cannot directly use abstract base classes"
+
+
+class Element(ModelNode):
+    # the superclass is injected with set_element_base
     implements(IElement)
     abstract = True
-    xmiid = None
 
     def check_model_constraints(self):
-        try:
-            assert(not self.abstract)
-        except AssertionError:
-            raise ModelIllFormedException,\
-                  str(self) +  " " +\
-                  "Cannot directly use abstract base classes"
+        _check_abstract(self)
 
     @property
     def stereotypes(self):
         return [o for o in self.filtereditems(IStereotype)]
 
 
+def set_element_base(base):
+    """Inject base as superclass of Element and so of all element classes.
+
+    base must derive from ModelNode and keep its instance layout, e.g. a
+    mixin adding hooks or attributes to all elements. Interfaces implemented
+    by base are provided by the elements. set_element_base(ModelNode)
+    restores the default.
+    """
+    if not isinstance(base, type) or not issubclass(base, ModelNode):
+        raise ValueError, u"The element base must derive from ModelNode"
+    Element.__bases__ = (base,)
+    spec = implementedBy(Element)
+    spec.__bases__ = tuple(spec.declared) + (implementedBy(base),)
+
+def get_element_base():
+    return Element.__bases__[0]
+
+
+def _check_activity_node(node):
+    try:
+        assert node.__parent__ is not None
+        assert IActivity.providedBy(node.__parent__)
+    except AssertionError:
+        raise ModelIllFormedException,\
+              str(node) +  " " +\
+              "An ActivityNode must have an Activity as parent"
+
+
 class ActivityNode(Element):
     implements(IActivityNode)
     abstract = True
 
     def check_model_constraints(self):
         super(ActivityNode, self).check_model_constraints()
-        try:
-            assert self.__parent__ is not None
-            assert IActivity.providedBy(self.__parent__)
-        except AssertionError:
-            raise ModelIllFormedException,\
-                  str(self) +  " " +\
-                  "An ActivityNode must have an Activity as parent"
+        _check_activity_node(self)
 
     @property
     def activity(self):
         return self.__parent__
 
-    # cache this
+    def _edges(self, index, attr):
+        activity = self.activity
+        if IActivity.providedBy(activity):
+            return activity._adjacent_edges(index, self)
+        if activity is None:
+            return []
+        # no adjacency index outside of activities, scan the edges
+        return [obj for obj in activity.filtereditems(IActivityEdge)\
+                if getattr(obj, attr) == self.uuid]
+
     @property
     def incoming_edges(self):
-        return [obj for obj in self.activity.filtereditems(IActivityEdge)\
-                if obj.target.uuid == self.uuid]
+        return self._edges('_incoming', 'target_uuid')
 
-    # cache this
     @property
     def outgoing_edges(self):
-        return [obj for obj in self.activity.filtereditems(IActivityEdge)\
-                if obj.source.uuid == self.uuid]
+        return self._edges('_outgoing', 'source_uuid')
+
+    # edge counts without building the edge lists, used by the model checks
+    @property
+    def _in_degree(self):
+        activity = self.activity
+        if IActivity.providedBy(activity):
+            return activity._degree('_incoming', self)
+        return len(self.incoming_edges)
+
+    @property
+    def _out_degree(self):
+        activity = self.activity
+        if IActivity.providedBy(activity):
+            return activity._degree('_outgoing', self)
+        return len(self.outgoing_edges)
 
 
 class Action(ActivityNode):
@@ -135,24 +418,77 @@ class ControlNode(ActivityNode):
     implements(IControlNode)
     abstract = True
 
+def _check_final_node(node):
+    try:
+        assert node._out_degree == 0
+    except AssertionError:
+        raise ModelIllFormedException,\
+              str(node) +  " " +\
+              u"FinalNode cannot have outgoing edges"
+
+
 class FinalNode(ControlNode):
     implements(IFinalNode)
     abstract = True
 
     def check_model_constraints(self):
         super(FinalNode, self).check_model_constraints()
-        try:
-            assert super(FinalNode, self).outgoing_edges == []
-        except AssertionError:
-            raise ModelIllFormedException,\
-                  str(self) +  " " +\
-                  u"FinalNode cannot have outgoing edges"
+        _check_final_node(self)
 
 ### CONCRETE CLASSES
 class Package(Element):
     implements(IPackage)
     abstract = False
 
+    def __init__(self, name=None):
+        # xmiid -> node index over the whole model, maintained while the
+        # package is the root of the model.
+        self._xmiids = dict()
+        # stereotype applications and their tagged values over the whole
+        # model, maintained while the package is the root of the model.
+        # (profile uuid, stereotype name) -> odict of stereotypes by uuid,
+        # (profile uuid, stereotype name, name, value) -> odict of tagged
+        # values by uuid. Tagged values with unhashable values are not
+        # indexed.
+        self._stereotypes = dict()
+        self._taggedvalues = dict()
+        super(Package, self).__init__(name)
+
+    def _index_stereotyped(self, node):
+        key = _stereotyped_key(node)
+        if key is None:
+            return
+        if IStereotype.providedBy(node):
+            index = self._stereotypes
+        else:
+            index = self._taggedvalues
+        bucket = index.get(key)
+        if bucket is None:
+            bucket = index[key] = odict()
+        bucket[node.uuid] = node
+        if IStereotypeApplication.providedBy(node):
+            # overridden tagged values are no children, index them here
+            for taggedvalue in node._overridden():
+                self._index_stereotyped(taggedvalue)
+
+    def _unindex_stereotyped(self, node):
+        key = _stereotyped_key(node)
+        if key is None:
+            return
+        if IStereotype.providedBy(node):
+            index = self._stereotypes
+        else:
+            index = self._taggedvalues
+        bucket = index.get(key)
+        if bucket is None or bucket.get(node.uuid) is not node:
+            return
+        del bucket[node.uuid]
+        if not bucket:
+            del index[key]
+        if IStereotypeApplication.providedBy(node):
+            for taggedvalue in node._overridden():
+                self._unindex_stereotyped(taggedvalue)
+
     @property
     def profiles(self):
         return [o for o in self.filtereditems(IProfile)]
@@ -165,6 +501,156 @@ class Activity(Behavior):
     implements(IActivity)
     abstract = False
 
+    # once validated, the activity records the elements affected by changes
+    # in _dirty (uuid -> element) for revalidation.
+    _validated = False
+
+    def __init__(self, name=None, context=None):
+        # adjacency index: node uuid -> list of edges, kept up to date on
+        # edge insertion, deletion and rewiring. the edge lists are in the
+        # order of the children, _positions maps the keys of the children to
+        # ascending numbers in that order.
+        self._incoming = dict()
+        self._outgoing = dict()
+        self._positions = dict()
+        self._next_position = 0
+        self._dirty = odict()
+        super(Activity, self).__init__(name, context)
+
+    def __setitem__(self, key, val):
+        if key in self:
+            self._unindex_edge(self[key])
+            self._mark_neighbours(self[key])
+        super(Activity, self).__setitem__(key, val)
+        self._place(key)
+        self._index_edge(val)
+        self._mark_neighbours(val)
+
+    def _insert_many(self, items):
+        super(Activity, self)._insert_many(items)
+        for key, val in items:
+            self._place(key)
+            self._index_edge(val)
+            self._mark_neighbours(val)
+
+    def _place(self, key):
+        # new keys are appended to the children, replaced ones keep their
+        # place
+        if key not in self._positions:
+            self._positions[key] = self._next_position
+            self._next_position += 1
+
+    def _position(self, key):
+        # place of the child key, for ordering the edge lists
+        return self._positions.get(key)
+
+    def __delitem__(self, key):
+        val = self[key]
+        self._unindex_edge(val)
+        self._positions.pop(key, None)
+        self._mark_neighbours(val)
+        if IActivityNode.providedBy(val):
+            # edges must not keep resolving to the removed node
+            for edge in self._incoming.get(val.uuid, ()):
+                edge._v_target = None
+            for edge in self._outgoing.get(val.uuid, ()):
+                edge._v_source = None
+        super(Activity, self).__delitem__(key)
+
+    def _mark(self, nodes):
+        if not self._validated:
+            return
+        for node in nodes:
+            if IElement.providedBy(node):
+                self._dirty[node.uuid] = node
+
+    def _mark_neighbours(self, node):
+        if not self._validated:
+            return
+        if IActivityEdge.providedBy(node):
+            self._mark([node.source, node.target])
+        elif IActivityNode.providedBy(node):
+            self._mark(self._incoming.get(node.uuid, ()))
+            self._mark(self._outgoing.get(node.uuid, ()))
+
+    def _contains(self, node):
+        while node is not self:
+            parent = node.__parent__
+            if parent is None or parent.get(node.__name__) is not node:
+                return False
+            node = parent
+        return True
+
+    def _set_validated(self, validated):
+        # validated activities start recording changes anew
+        if validated:
+            self._dirty = odict()
+        self._validated = validated
+
+    def _revalidate(self):
+        """Check the activity and the elements marked dirty.
+        """
+        self.check_model_constraints()
+        dirty = self._dirty
+        for uuid in dirty.keys():
+            node = dirty[uuid]
+            if self._contains(node):
+                node.check_model_constraints()
+            del dirty[uuid]
+
+    def _index_edge(self, edge):
+        if not IActivityEdge.providedBy(edge):
+            return
+        self._link('_incoming', edge.target_uuid, edge)
+        self._link('_outgoing', edge.source_uuid, edge)
+
+    def _unindex_edge(self, edge):
+        if not IActivityEdge.providedBy(edge):
+            return
+        self._unlink('_incoming', edge.target_uuid, edge)
+        self._unlink('_outgoing', edge.source_uuid, edge)
+
+    def _link(self, index, node_uuid, edge):
+        if node_uuid is None:
+            return
+        edges = getattr(self, index).setdefault(node_uuid, list())
+        edges.append(edge)
+        # rewired edges are appended, move them to their place
+        position = self._position
+        if len(edges) > 1 and \
+           position(edges[-2].__name__) > position(edge.__name__):
+            edges.sort(key=lambda obj: position(obj.__name__))
+
+    def _unlink(self, index, node_uuid, edge):
+        edges = getattr(self, index).get(node_uuid)
+        if not edges:
+            return
+        # compare by identity, nodes are dicts and compare by content
+        for i, obj in enumerate(edges):
+            if obj is edge:
+                del edges[i]
+                break
+        if not edges:
+            del getattr(self, index)[node_uuid]
+
+    def _adjacent_edges(self, index, node):
+        return list(getattr(self, index).get(node.uuid, ()))
+
+    def _degree(self, index, node):
+        return len(getattr(self, index).get(node.uuid, ()))
+
+    def _reindex(self):
+        """Rebuild the adjacency index in one sweep over the edges.
+        """
+        self._incoming = dict()
+        self._outgoing = dict()
+        self._positions = dict()
+        self._next_position = 0
+        for key in self.keys():
+            self._place(key)
+        for edge in self.filtereditems(IActivityEdge):
+            self._index_edge(edge)
+
     def check_model_constraints(self):
         super(Activity, self).check_model_constraints()
         try:
@@ -197,52 +683,61 @@ class OpaqueAction(Action):
     abstract = False
 
 
+def _check_activity_edge(node):
+    try:
+        assert node.source or node.target is not None
+    except AssertionError:
+        raise ModelIllFormedException,\
+              str(node) +  " " +\
+              "An ActivityEdge must have source and target set"
+
+    # [1]
+    try:
+        assert node.source.activity is node.target.activity
+    except AssertionError:
+        raise ModelIllFormedException,\
+              str(node) +  " " +\
+              "Source and target must be in the same activity"
+
+    # [2]
+    try:
+        assert node.__parent__ is not None
+        assert IActivity.providedBy(node.__parent__)
+    except AssertionError:
+        raise ModelIllFormedException,\
+              str(node) +  " " +\
+              "An ActivityEdge must have an Activity as parent"
+
+    try:
+        assert IActivityNode.providedBy(node.source)
+    except AssertionError:
+        raise ModelIllFormedException,\
+              str(node) +  " " +\
+              "An ActivityEdge must have an ActivityNode as source"
+
+    try:
+        assert IActivityNode.providedBy(node.target)
+    except AssertionError:
+        raise ModelIllFormedException,\
+              str(node) +  " " +\
+              "An ActivityEdge must have an ActivityNode as target"
+
+
 class ActivityEdge(Element):
     implements(IActivityEdge)
     abstract = False
 
     def check_model_constraints(self):
         super(ActivityEdge, self).check_model_constraints()
-        try:
-            assert self.source or self.target is not None
-        except AssertionError:
-            raise ModelIllFormedException,\
-                  str(self) +  " " +\
-                  "An ActivityEdge must have source and target set"
-
-        # [1]
-        try:
-            assert self.source.activity is self.target.activity
-        except AssertionError:
-            raise ModelIllFormedException,\
-                  str(self) +  " " +\
-                  "Source and target must be in the same activity"
-
-        # [2]
-        try:
-            assert self.__parent__ is not None
-            assert IActivity.providedBy(self.__parent__)
-        except AssertionError:
-            raise ModelIllFormedException,\
-                  str(self) +  " " +\
-                  "An ActivityEdge must have an Activity as parent"
-
-        try:
-            assert IActivityNode.providedBy(self.source)
-        except AssertionError:
-            raise ModelIllFormedException,\
-                  str(self) +  " " +\
-                  "An ActivityEdge must have an ActivityNode as source"
-
-        try:
-            assert IActivityNode.providedBy(self.target)
-        except AssertionError:
-            raise ModelIllFormedException,\
-                  str(self) +  " " +\
-                  "An ActivityEdge must have an ActivityNode as target"
+        _check_activity_edge(self)
 
+    # source_uuid and target_uuid identify the endpoints for serialization
+    # and re-binding after load. _v_source and _v_target hold weak references
+    # to the resolved endpoint nodes.
     source_uuid = None
     target_uuid = None
+    _v_source = None
+    _v_target = None
 
     def __init__(self, name=None, source=None, target=None, guard=None):
         # TODO: bool(source) evals to False if IControlNode.providedBy(source)
@@ -257,35 +752,94 @@ class ActivityEdge(Element):
     def activity(self):
         return self.__parent__
 
+    def _rewire(self, index, attr, node):
+        # keep the adjacency index of the containing activity up to date
+        activity = getattr(self, '__parent__', None)
+        indexed = IActivity.providedBy(activity) and \
+                  activity.get(self.__name__) is self
+        if indexed:
+            activity._unlink(index, getattr(self, attr), self)
+            activity._mark([self, activity.node(getattr(self, attr)), node])
+        setattr(self, attr, node.uuid)
+        if indexed:
+            activity._link(index, node.uuid, self)
+
+    def _resolve(self, refattr, uuid):
+        ref = getattr(self, refattr)
+        if ref is not None:
+            node = ref()
+            if node is not None:
+                return node
+        if uuid is None:
+            return None
+        # not bound yet, i.e. after loading. resolve by uuid and bind.
+        node = self.node(uuid)
+        if node is not None:
+            setattr(self, refattr, weakref.ref(node))
+        return node
+
     def get_source(self):
-        return self.node(self.source_uuid)
+        return self._resolve('_v_source', self.source_uuid)
     def set_source(self, source):
-        # TODO: invalidate cache key for target's outgoingEdges method
-        self.source_uuid = source.uuid
+        self._rewire('_outgoing', 'source_uuid', source)
+        self._v_source = weakref.ref(source)
     source = property(get_source, set_source)
 
     def get_target(self):
-        return self.node(self.target_uuid)
+        return self._resolve('_v_target', self.target_uuid)
     def set_target(self, target):
-        # TODO: invalidate cache key for target's incomingEdges method
-        self.target_uuid = target.uuid
+        self._rewire('_incoming', 'target_uuid', target)
+        self._v_target = weakref.ref(target)
     target = property(get_target, set_target)
 
+    # the guard is compiled once on first use into _v_guard_code
+    _guard = None
+    _v_guard_code = None
+
+    def get_guard(self):
+        return self._guard
+    def set_guard(self, guard):
+        self._guard = guard
+        self._v_guard_code = None
+    guard = property(get_guard, set_guard)
+
+    @property
+    def is_else(self):
+        return self._guard is not None and self._guard.strip() == ELSE
+
+    @property
+    def guard_code(self):
+        if self._v_guard_code is None and self._guard is not None \
+           and not self.is_else:
+            self._v_guard_code = _compile(self._guard, '<guard>')
+        return self._v_guard_code
+
+    def evaluate_guard(self, context=None):
+        if self._guard is None:
+            return True
+        if self.is_else:
+            return False
+        return _evaluate(self.guard_code, context)
+
 
 ### Initial and final
+def _check_initial_node(node):
+    # [1]
+    try:
+        assert node._in_degree == 0
+    except AssertionError:
+        raise ModelIllFormedException,\
+              str(node) +  " " +\
+              u"InitialNode cannot have incoming edges"
+
+
 class InitialNode(ControlNode):
     implements(IInitialNode)
     abstract = False
 
     def check_model_constraints(self):
         super(InitialNode, self).check_model_constraints()
-        # [1]
-        try:
-            assert super(InitialNode, self).incoming_edges == []
-        except AssertionError:
-            raise ModelIllFormedException,\
-                  str(self) +  " " +\
-                  u"InitialNode cannot have incoming edges"
+        _check_initial_node(self)
 
 class ActivityFinalNode(FinalNode):
     implements(IActivityFinalNode)
@@ -296,21 +850,47 @@ class FlowFinalNode(FinalNode):
     abstract = False
 
 ### More control nodes
+def _check_decision_node(node):
+    # [1]
+    try:
+        assert node._in_degree == 1
+        assert node._out_degree >= 1
+    except AssertionError:
+        raise ModelIllFormedException,\
+              str(node) +  " " +\
+              "A DecisionNode has one incoming edge and at least"\
+              "one outgoing edge."
+
+
 class DecisionNode(ControlNode):
     implements(IDecisionNode)
     abstract = False
 
     def check_model_constraints(self):
         super(DecisionNode, self).check_model_constraints()
-        # [1]
-        try:
-            assert len(self.incoming_edges) is 1
-            assert len(self.outgoing_edges) >= 1
-        except AssertionError:
-            raise ModelIllFormedException,\
-                  str(self) +  " " +\
-                  "A DecisionNode has one incoming edge and at least"\
-                  "one outgoing edge."
+        _check_decision_node(self)
+
+    def decide(self, context=None):
+        """Outgoing edges whose guards hold, else the else edges.
+        """
+        edges = self.outgoing_edges
+        chosen = [edge for edge in edges \
+                  if not edge.is_else and edge.evaluate_guard(context)]
+        if chosen:
+            return chosen
+        return [edge for edge in edges if edge.is_else]
+
+
+def _check_fork_node(node):
+    # [1]
+    try:
+        assert node._in_degree == 1
+        assert node._out_degree >= 1
+    except AssertionError:
+        raise ModelIllFormedException,\
+              str(node) +  " " +\
+              "A ForkNode has one incoming edge and at least "\
+              "one outgoing edge."
 
 
 class ForkNode(ControlNode):
@@ -319,15 +899,19 @@ class ForkNode(ControlNode):
 
     def check_model_constraints(self):
         super(ForkNode, self).check_model_constraints()
-        # [1]
-        try:
-            assert len(self.incoming_edges) is 1
-            assert len(self.outgoing_edges) >= 1
-        except AssertionError:
-            raise ModelIllFormedException,\
-                  str(self) +  " " +\
-                  "A ForkNode has one incoming edge and at least "\
-                  "one outgoing edge."
+        _check_fork_node(self)
+
+
+def _check_join_node(node):
+    # [1]
+    try:
+        assert node._in_degree >= 1
+        assert node._out_degree == 1
+    except AssertionError:
+        raise ModelIllFormedException,\
+              str(node) +  " " +\
+              u"A join node has one outgoing edge and at least "\
+              u"one incoming edge."
 
 
 class JoinNode(ControlNode):
@@ -336,15 +920,19 @@ class JoinNode(ControlNode):
 
     def check_model_constraints(self):
         super(JoinNode, self).check_model_constraints()
-        # [1]
-        try:
-            assert len(self.incoming_edges) >= 1
-            assert len(self.outgoing_edges) is 1
-        except AssertionError:
-            raise ModelIllFormedException,\
-                  str(self) +  " " +\
-                  u"A join node has one outgoing edge and at least "\
-                  u"one incoming edge."
+        _check_join_node(self)
+
+
+def _check_merge_node(node):
+    # [1]
+    try:
+        assert node._in_degree >= 1
+        assert node._out_degree == 1
+    except AssertionError:
+        raise ModelIllFormedException,\
+              str(node) +  " " +\
+              u"A merge node has one outgoing edge and at least"\
+              u"one incoming edge."
 
 
 # TODO: UML2's MergeNode behavior does not reduce concurrency
@@ -356,15 +944,7 @@ class MergeNode(ControlNode):
 
     def check_model_constraints(self):
         super(MergeNode, self).check_model_constraints()
-        # [1]
-        try:
-            assert len(self.incoming_edges) >= 1
-            assert len(self.outgoing_edges) is 1
-        except AssertionError:
-            raise ModelIllFormedException,\
-                  str(self) +  " " +\
-                  u"A merge node has one outgoing edge and at least"\
-                  u"one incoming edge."
+        _check_merge_node(self)
 
 
 ### Constraints
@@ -372,6 +952,11 @@ class Constraint(Element):
     implements(IConstraint)
     abstract = False
 
+    # the specification is compiled once on first use into
+    # _v_specification_code
+    _specification = None
+    _v_specification_code = None
+
     def __init__(self, name=None, specification=None):
         self.specification = specification
         super(Constraint, self).__init__(name)
@@ -380,6 +965,26 @@ class Constraint(Element):
     def constrained_element(self):
         return self.__parent__
 
+    def get_specification(self):
+        return self._specification
+    def set_specification(self, specification):
+        self._specification = specification
+        self._v_specification_code = None
+    specification = property(get_specification, set_specification)
+
+    @property
+    def specification_code(self):
+        if self._v_specification_code is None \
+           and self._specification is not None:
+            self._v_specification_code = _compile(
+                self._specification, '<specification>')
+        return self._v_specification_code
+
+    def evaluate(self, context=None):
+        if self._specification is None:
+            return True
+        return _evaluate(self.specification_code, context)
+
 class PreConstraint(Constraint):
     implements(IPreConstraint)
     abstract = False
@@ -389,19 +994,31 @@ class PostConstraint(Constraint):
     abstract = False
 
 ### Profile UML Extension Mechanism
-class Profile(Node):
+class Profile(ModelNode):
     implements(IProfile)
     abstract = False
 
-    ### TODO: let owned_stereotypes return the stereotypes defined in profile
-    #def __init__(self, name):
-    #    super(Profile,self).__init__(name)
-    #    owned_stereotypes = dict()
+    @property
+    def stereotypes(self):
+        """Stereotypes defined in the profile.
 
-    #def add_stereotype(self, name, extentended):
-    #    owned_stereotypes['name'] = type(name,
-    #                                     (Stereotype,),
-    #                                     {'extended': extended})
+        Their tagged values are the defaults of the stereotype applications
+        referencing them, see compact.StereotypeApplication.
+        """
+        return [o for o in self.filtereditems(IStereotype)]
+    owned_stereotypes = stereotypes
+
+    def add_stereotype(self, name, taggedvalues=None):
+        """Define a stereotype with the given default tagged values, a dict or
+        list of (name, value) pairs.
+        """
+        if isinstance(taggedvalues, dict):
+            taggedvalues = taggedvalues.items()
+        definition = Stereotype(profile=self)
+        for key, value in taggedvalues or ():
+            definition[key] = TaggedValue(value=value)
+        self[name] = definition
+        return definition
 
     # TODO: Add check_model_constraints - profile only part of package
 
@@ -409,7 +1026,7 @@ class Profile(Node):
     # profiles applied to profile to distinguish between execution-loading
     # profiles and profiles other ones.
 
-class Stereotype(Node):
+class Stereotype(ModelNode):
     implements(IStereotype)
     abstract = False
 
@@ -427,30 +1044,288 @@ class Stereotype(Node):
     def taggedvalues(self):
         return [o for o in self.filtereditems(ITaggedValue)]
 
-class TaggedValue(Node):
+class TaggedValue(ModelNode):
     implements(ITaggedValue)
     abstract = False
 
     def __init__(self, name=None, value=None):
-        self.value = value
+        self._value = value
         super(TaggedValue, self).__init__(name)
 
+    def get_value(self):
+        return self._value
+    def set_value(self, value):
+        # keep the tagged value index of the model up to date
+        root = self._model_root
+        if root is not None:
+            root._unindex_stereotyped(self)
+        self._value = value
+        if root is not None:
+            root._index_stereotyped(self)
+    value = property(get_value, set_value)
+
+
+def _stereotyped_key(node):
+    """Key of a stereotype or tagged value in the stereotype indexes of the
+    model, None if not indexed.
+    """
+    if IStereotype.providedBy(node):
+        if IProfile.providedBy(node.__parent__):
+            # stereotype defined in a profile, not applied
+            return None
+        return (node.profile.uuid, node.__name__)
+    if not ITaggedValue.providedBy(node):
+        return None
+    stereotype = node.__parent__
+    if not IStereotype.providedBy(stereotype) \
+       or IProfile.providedBy(stereotype.__parent__):
+        return None
+    try:
+        hash(node.value)
+    except TypeError:
+        return None
+    return (stereotype.profile.uuid, stereotype.__name__, node.__name__,
+            node.value)
+
+
+def validate(node, workers=None):
+    """Model validation in tree order.
+
+    The adjacency index of each activity is rebuilt in one sweep over its
+    edges before its children are checked, so the degree checks of the nodes
+    are constant time and an activity validates in linear time.
+
+    If workers is given, activities are checked in a pool of that many worker
+    processes. The error raised is the one validation in tree order raises.
+
+    Validated activities start recording changes for revalidate.
+    """
+    activities = list()
+    try:
+        if workers and hasattr(os, 'fork'):
+            _validate_pooled(node, workers, activities)
+        else:
+            _validate_tree(node, activities)
+    except:
+        # elements not reached are unchecked, validate completely next time
+        for activity in activities:
+            activity._set_validated(False)
+        raise
+
+def _validate_tree(node, activities):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if IElement.providedBy(node):
+            node.check_model_constraints()
+        if IActivity.providedBy(node):
+            node._reindex()
+            node._set_validated(True)
+            activities.append(node)
+        children = list(node.filtereditems(IElement))
+        children.reverse()
+        stack.extend(children)
+
+# activities checked by the worker processes, inherited on fork
+_pooled_activities = None
+
+def _validate_pooled_activity(index):
+    try:
+        _validate_tree(_pooled_activities[index], list())
+    except Exception, e:
+        return e
+    return None
+
+def _validate_pooled(node, workers, activities):
+    # check everything outside of activities in tree order and stop at the
+    # first error, as validation in tree order does. activities found before
+    # are checked in the pool.
+    global _pooled_activities
+    error = None
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if IActivity.providedBy(node):
+            node._reindex()
+            activities.append(node)
+            continue
+        if IElement.providedBy(node):
+            try:
+                node.check_model_constraints()
+            except Exception, e:
+                error = e
+                break
+        children = list(node.filtereditems(IElement))
+        children.reverse()
+        stack.extend(children)
+    results = list()
+    if activities:
+        _pooled_activities = activities
+        try:
+            pool = multiprocessing.Pool(workers)
+            try:
+                results = pool.map(_validate_pooled_activity,
+                                   range(len(activities)))
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            _pooled_activities = None
+    for activity in activities:
+        activity._set_validated(True)
+    # activities precede the element which failed in the tree
+    for result in results:
+        if result is not None:
+            raise result
+    if error is not None:
+        raise error
+
+def revalidate(node):
+    """Check only the elements affected by changes since the last validation.
+
+    Activities validated before only check themselves and the elements marked
+    dirty by changes, i.e. changed elements and the edges and nodes connected
+    to them. Activities not validated before are validated completely.
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if IActivity.providedBy(node):
+            if node._validated:
+                node._revalidate()
+            else:
+                validate(node)
+            continue
+        if IElement.providedBy(node):
+            node.check_model_constraints()
+        children = list(node.filtereditems(IElement))
+        children.reverse()
+        stack.extend(children)
+
+# no tagged value given
+_marker = object()
+
+def get_elements_by_stereotype(node, profile, stereotype, name=None,
+                               value=_marker):
+    """Elements within node with the stereotype of given name of profile, a
+    Profile or its name, applied.
+
+    If name is given, only elements whose stereotype has a tagged value of
+    that name are found, and if value is given too, only those where it has
+    that value. Uses the stereotype indexes of the root package if node is
+    part of a model, otherwise searches all nodes below node. Stereotypes
+    defined in profiles are not applied and not found.
+    """
+    root = node.root
+    if not IPackage.providedBy(root):
+        return _find_stereotyped(node, profile, stereotype, name, value)
+    if not IProfile.providedBy(profile):
+        profile = _profile_named(root, profile)
+        if profile is None:
+            return list()
+    if name is None:
+        stereotypes = root._stereotypes.get((profile.uuid, stereotype), {})
+        stereotypes = stereotypes.values()
+    elif value is _marker:
+        stereotypes = root._stereotypes.get((profile.uuid, stereotype), {})
+        stereotypes = [s for s in stereotypes.values() if name in s]
+    else:
+        try:
+            hash(value)
+        except TypeError:
+            return _find_stereotyped(node, profile, stereotype, name, value)
+        key = (profile.uuid, stereotype, name, value)
+        stereotypes = [tv.__parent__ for tv in \
+                       root._taggedvalues.get(key, {}).values()]
+        # applications of a profile defined stereotype with that default
+        stereotypes += _inheriting(root, profile, stereotype, name, value)
+    found = list()
+    seen = set()
+    for stereotype in stereotypes:
+        element = stereotype.__parent__
+        if id(element) in seen:
+            continue
+        if node is not root:
+            for parent in LocationIterator(element):
+                if parent is node:
+                    break
+            else:
+                continue
+        seen.add(id(element))
+        found.append(element)
+    return found
+
+def _profile_named(root, name):
+    """Profile of given name in root or the packages below, the one nearest
+    to root first. None if there is none.
+
+    Only visits packages, profiles are children of packages keyed by their
+    name.
+    """
+    packages = [root]
+    while packages:
+        nested = list()
+        for package in packages:
+            profile = package.get(name)
+            if IProfile.providedBy(profile):
+                return profile
+            nested.extend(package.filtereditems(IPackage))
+        packages = nested
+    return None
 
-def validate(node):
-    """Recursive model validation
+def _inheriting(root, profile, stereotype, name, value):
+    """Applications of the stereotype defined in profile which inherit value
+    for the tagged value name from the definition.
     """
-    if IElement.providedBy(node):
-        node.check_model_constraints()
-    for sub in node.filtereditems(IElement):
-        validate(sub)
+    definition = profile.get(stereotype)
+    if not IStereotype.providedBy(definition):
+        return list()
+    default = definition.get(name)
+    if default is None or default.value != value:
+        return list()
+    bucket = root._stereotypes.get((profile.uuid, stereotype), {})
+    return [s for s in bucket.values() \
+            if IStereotypeApplication.providedBy(s) \
+            and s.definition is definition and name not in s.overrides]
+
+def _find_stereotyped(node, profile, stereotype, name, value):
+    found = list()
+    for sub in _subtree(node):
+        if not IStereotype.providedBy(sub) or sub.__name__ != stereotype \
+           or IProfile.providedBy(sub.__parent__):
+            continue
+        if IProfile.providedBy(profile):
+            if sub.profile is not profile:
+                continue
+        elif sub.profile.__name__ != profile:
+            continue
+        if name is not None:
+            taggedvalue = sub.get(name)
+            if taggedvalue is None:
+                continue
+            if value is not _marker and taggedvalue.value != value:
+                continue
+        element = sub.__parent__
+        if not [e for e in found if e is element]:
+            found.append(element)
+    return found
 
 def get_element_by_xmiid(node, xmiid):
-    if node.xmiid == xmiid:
-        return node
-    # TODO: may not get all elements if an INode but not IElement providing
-    # element sits within the hierachy
-    for el in node.filtereditems(IElement):
-        ele = get_element_by_xmiid(el, xmiid)
-        if ele is not None:
-            return ele
+    """Find the node with given xmiid within node.
+
+    Uses the xmiid index of the root package if node is part of a model,
+    otherwise searches all nodes below node.
+    """
+    root = node.root
+    if IPackage.providedBy(root):
+        element = root._xmiids.get(xmiid)
+        if element is None:
+            return None
+        for parent in LocationIterator(element):
+            if parent is node:
+                return element
+        return None
+    for sub in _subtree(node):
+        if getattr(sub, 'xmiid', None) == xmiid:
+            return sub
     return None
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+import weakref
+from array import array
+
+from activities.metamodel.elements import ModelIllFormedException
+from activities.metamodel.interfaces import IActivityEdge
+from activities.metamodel.interfaces import IActivityFinalNode
+from activities.metamodel.interfaces import IActivityNode
+from activities.metamodel.interfaces import IDecisionNode
+from activities.metamodel.interfaces import IFlowFinalNode
+from activities.metamodel.interfaces import IForkNode
+from activities.metamodel.interfaces import IInitialNode
+from activities.metamodel.interfaces import IJoinNode
+from activities.metamodel.interfaces import IMergeNode
+from activities.metamodel.interfaces import IOpaqueAction
+
+### NODE KIND CODES
+OTHER = 0
+INITIAL = 1
+FORK = 2
+JOIN = 3
+DECISION = 4
+MERGE = 5
+ACTIVITY_FINAL = 6
+FLOW_FINAL = 7
+OPAQUE_ACTION = 8
+
+_KINDS = [
+    (IInitialNode, INITIAL),
+    (IForkNode, FORK),
+    (IJoinNode, JOIN),
+    (IDecisionNode, DECISION),
+    (IMergeNode, MERGE),
+    (IActivityFinalNode, ACTIVITY_FINAL),
+    (IFlowFinalNode, FLOW_FINAL),
+    (IOpaqueAction, OPAQUE_ACTION),
+]
+
+def kind_of(node):
+    for iface, kind in _KINDS:
+        if iface.providedBy(node):
+            return kind
+    return OTHER
+
+
+def _csr(count, keys):
+    """Compressed sparse row layout of the positions in keys, grouped by key.
+
+    Returns offsets of length count + 1 and the positions, ordered by key and
+    stable within each key.
+    """
+    offsets = array('l', [0] * (count + 1))
+    for key in keys:
+        offsets[key + 1] += 1
+    for i in xrange(count):
+        offsets[i + 1] += offsets[i]
+    fill = array('l', offsets[:-1])
+    positions = array('l', [0] * len(keys))
+    for position, key in enumerate(keys):
+        positions[fill[key]] = position
+        fill[key] += 1
+    return offsets, positions
+
+
+class FrozenActivity(object):
+    """Read-only, array backed graph of an activity.
+
+    Nodes and edges are numbered in the order of the activity. Node ids index
+    kinds, names and uuids. Edge ids index sources, targets, guards, compiled
+    guards, names and uuids. The edges leaving node i are
+    out_edges[out_offsets[i]:out_offsets[i + 1]], the edges entering it are
+    in_edges[in_offsets[i]:in_offsets[i + 1]], both in the order of the
+    activity.
+    """
+
+    def __init__(self, activity):
+        self._activity = weakref.ref(activity)
+        self.name = activity.__name__
+        nodes = list(activity.filtereditems(IActivityNode))
+        edges = list(activity.filtereditems(IActivityEdge))
+        self.uuids = [node.uuid for node in nodes]
+        self.names = [node.__name__ for node in nodes]
+        self.kinds = array('b', [kind_of(node) for node in nodes])
+        self.ids = dict([(uuid, i) for i, uuid in enumerate(self.uuids)])
+        self.edge_uuids = [edge.uuid for edge in edges]
+        self.edge_names = [edge.__name__ for edge in edges]
+        self.guards = [edge.guard for edge in edges]
+        self.guard_codes = [edge.guard_code for edge in edges]
+        self.sources = array('l', [self._node_id(edge, edge.source_uuid) \
+                                   for edge in edges])
+        self.targets = array('l', [self._node_id(edge, edge.target_uuid) \
+                                   for edge in edges])
+        self.out_offsets, self.out_edges = _csr(len(nodes), self.sources)
+        self.in_offsets, self.in_edges = _csr(len(nodes), self.targets)
+
+    def _node_id(self, edge, uuid):
+        try:
+            return self.ids[uuid]
+        except KeyError:
+            raise ModelIllFormedException,\
+                  str(edge) + " " +\
+                  "Source and target must be in the same activity"
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @property
+    def edge_count(self):
+        return len(self.sources)
+
+    def outgoing(self, i):
+        """Edge ids leaving node i.
+        """
+        return self.out_edges[self.out_offsets[i]:self.out_offsets[i + 1]]
+
+    def incoming(self, i):
+        """Edge ids entering node i.
+        """
+        return self.in_edges[self.in_offsets[i]:self.in_offsets[i + 1]]
+
+    def successors(self, i):
+        targets = self.targets
+        return [targets[e] for e in self.outgoing(i)]
+
+    def predecessors(self, i):
+        sources = self.sources
+        return [sources[e] for e in self.incoming(i)]
+
+    def of_kind(self, kind):
+        return [i for i, k in enumerate(self.kinds) if k == kind]
+
+    def id_of(self, element):
+        """Node id of the given node element.
+        """
+        return self.ids[element.uuid]
+
+    @property
+    def activity(self):
+        return self._activity()
+
+    def node(self, i):
+        """The node element with id i, looked up in the original activity.
+        """
+        return self.activity.node(self.uuids[i])
+
+    def edge(self, e):
+        """The edge element with id e, looked up in the original activity.
+        """
+        return self.activity.node(self.edge_uuids[e])
+
+
+def freeze(activity):
+    """Compile activity into a FrozenActivity.
+
+    The frozen graph does not follow later changes of the activity.
+    """
+    return FrozenActivity(activity)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+import threading
+from timeit import default_timer
+
+from activities.metamodel import compact
+from activities.metamodel import elements
+from activities.metamodel.interfaces import IActivity
+
+# Counters of hot path operations, per operation, element class and activity.
+#
+# Instrumentation is off by default and then costs nothing: enable wraps the
+# instrumented methods of the element classes, disable puts the originals
+# back. Times are inclusive, e.g. resolving edge endpoints during a model
+# check counts for both operations. Operations done in worker processes of
+# a pooled validation are not counted.
+
+EDGE_SCAN = 'edge_scan'
+RESOLVE = 'resolve'
+FILTEREDITEMS = 'filtereditems'
+CHECK = 'check_model_constraints'
+
+# (class, attribute, operation)
+_INSTRUMENTED = [
+    (elements.ActivityNode, 'incoming_edges', EDGE_SCAN),
+    (elements.ActivityNode, 'outgoing_edges', EDGE_SCAN),
+    (compact.CompactActivityNode, 'incoming_edges', EDGE_SCAN),
+    (compact.CompactActivityNode, 'outgoing_edges', EDGE_SCAN),
+    (elements.ActivityEdge, '_resolve', RESOLVE),
+    (compact.ActivityEdge, '_resolve', RESOLVE),
+    (elements.ModelNode, 'filtereditems', FILTEREDITEMS),
+]
+
+def _checking_classes():
+    classes = list()
+    for module in (elements, compact):
+        for obj in vars(module).values():
+            if isinstance(obj, type) \
+               and 'check_model_constraints' in obj.__dict__ \
+               and obj.__module__ == module.__name__:
+                classes.append(obj)
+    return classes
+
+_lock = threading.Lock()
+# (operation, element class name, activity name) -> [count, seconds]
+_counters = dict()
+# saved originals, (class, attribute, original)
+_originals = list()
+# ids of the elements in a model check, super calls are not counted again
+_checking = set()
+
+
+def _activity_name(element):
+    node = element
+    while node is not None:
+        if IActivity.providedBy(node):
+            return node.__name__
+        node = getattr(node, '__parent__', None)
+    return None
+
+def _record(operation, element, seconds):
+    key = (operation, element.__class__.__name__, _activity_name(element))
+    _lock.acquire()
+    try:
+        counter = _counters.get(key)
+        if counter is None:
+            counter = _counters[key] = [0, 0.0]
+        counter[0] += 1
+        counter[1] += seconds
+    finally:
+        _lock.release()
+
+
+def _timed(function, operation):
+    def timed(self, *args, **kw):
+        start = default_timer()
+        try:
+            return function(self, *args, **kw)
+        finally:
+            _record(operation, self, default_timer() - start)
+    timed.__name__ = function.__name__
+    timed.__doc__ = function.__doc__
+    return timed
+
+def _timed_check(function):
+    def check_model_constraints(self):
+        key = id(self)
+        if key in _checking:
+            # super call of a check already counted
+            return function(self)
+        _checking.add(key)
+        start = default_timer()
+        try:
+            return function(self)
+        finally:
+            _checking.discard(key)
+            _record(CHECK, self, default_timer() - start)
+    check_model_constraints.__doc__ = function.__doc__
+    return check_model_constraints
+
+
+def is_enabled():
+    return bool(_originals)
+
+def enable():
+    """Start counting. Counters are kept from earlier runs, see reset.
+    """
+    if _originals:
+        return
+    targets = list(_INSTRUMENTED)
+    targets += [(cls, 'check_model_constraints', CHECK) \
+                for cls in _checking_classes()]
+    for cls, name, operation in targets:
+        original = cls.__dict__[name]
+        if isinstance(original, property):
+            wrapped = property(_timed(original.fget, operation),
+                               original.fset, original.fdel, original.__doc__)
+        elif operation == CHECK:
+            wrapped = _timed_check(original)
+        else:
+            wrapped = _timed(original, operation)
+        _originals.append((cls, name, original))
+        setattr(cls, name, wrapped)
+
+def disable():
+    """Stop counting and restore the uninstrumented methods.
+    """
+    while _originals:
+        cls, name, original = _originals.pop()
+        setattr(cls, name, original)
+
+def reset():
+    """Clear all counters.
+    """
+    _lock.acquire()
+    try:
+        _counters.clear()
+    finally:
+        _lock.release()
+
+def snapshot():
+    """Current counters as list of dicts with the keys operation, element,
+    activity, count and seconds, sorted by operation, element and activity.
+    activity is None for elements outside of activities.
+    """
+    _lock.acquire()
+    try:
+        items = sorted(_counters.items())
+    finally:
+        _lock.release()
+    return [dict(operation=operation, element=element, activity=activity,
+                 count=count, seconds=seconds) \
+            for (operation, element, activity), (count, seconds) in items]
@@ -163,6 +163,22 @@ class IActivityEdge(IElement):
         u'Specification evaluated at runtime to determine if the edge can be'
         u'traversed. A python expression which must evaluate to True'
     )
+    is_else = Attribute(
+        u'True if the guard is "else", which marks the default branch of a '
+        u'decision.'
+    )
+    guard_code = Attribute(
+        u'The compiled guard expression. Compiled once and cached until the '
+        u'guard is reassigned. None if there is no guard or it is "else".'
+    )
+
+    def evaluate_guard(context=None):
+        """Evaluate the guard with the names of the context mapping.
+
+        Edges without a guard can always be traversed. "else" guards never
+        hold by themselves, they are chosen by the decision node if no other
+        guard holds.
+        """
 
 
 class IActivityNode(IElement):
@@ -455,6 +471,11 @@ class IDecisionNode(IControlNode):
         - A decision node has XOR semantics
     """
 
+    def decide(context=None):
+        """Return the outgoing edges whose guards hold for context. If none
+        holds, return the outgoing edges guarded with "else".
+        """
+
 
 class IForkNode(IControlNode):
     """A fork node is a control node that splits a flow into multiple concurrent
@@ -544,11 +565,19 @@ class IConstraint(IElement):
     specification = Attribute(
         u"The python expression which must be fulfilled."
     )
+    specification_code = Attribute(
+        u"The compiled specification. Compiled once and cached until the "
+        u"specification is reassigned."
+    )
     constrained_element = Attribute(
         u"The element which references the constraint."
         u"This element is the constraint's context."
     )
 
+    def evaluate(context=None):
+        """Evaluate the specification with the names of the context mapping.
+        """
+
 class IPreConstraint(IConstraint):
     """Marker interface for conditions which must be evaluated before any other
     operations.
@@ -576,6 +605,15 @@ class IStereotype(INode):
     taggedvalues = Attribute(
         u"""List of ITaggedValue elements defined in stereotype""")
 
+class IStereotypeApplication(IStereotype):
+    """Stereotype applied by reference to a stereotype defined in a profile.
+    Tagged values not overridden are the ones of the definition.
+    """
+    definition = Attribute(
+        u"""The IStereotype element defined in the profile.""")
+    overrides = Attribute(
+        u"""Dict of the overridden tagged values, name to value.""")
+
 class ITaggedValue(INode):
     """UML tagged value.
     """
@@ -0,0 +1,500 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+import mmap
+import struct
+import sys
+import uuid
+from array import array
+
+from activities.metamodel.elements import _subtree
+from activities.metamodel.interfaces import IActivity
+from activities.metamodel.interfaces import IActivityEdge
+from activities.metamodel.interfaces import IActivityNode
+from activities.metamodel.interfaces import IConstraint
+from activities.metamodel.interfaces import IDecisionNode
+from activities.metamodel.interfaces import IPackage
+from activities.metamodel.interfaces import IStereotype
+from activities.metamodel.interfaces import IStereotypeApplication
+from activities.metamodel.interfaces import ITaggedValue
+from activities.metamodel.snapshot import CLASSES
+from activities.metamodel.snapshot import _CODES
+from activities.metamodel.snapshot import _Strings
+from activities.metamodel.snapshot import encode
+from activities.metamodel.views import ActivityEdgeView
+from activities.metamodel.views import ActivityNodeView
+from activities.metamodel.views import ActivityView
+from activities.metamodel.views import ConstraintView
+from activities.metamodel.views import DecisionNodeView
+from activities.metamodel.views import ElementView
+from activities.metamodel.views import PackageView
+from activities.metamodel.views import view_classes
+
+# Layout, all little endian, tables at the offsets given in the header:
+#
+# elements: one RECORD per element in tree order, the root first
+# children: int32 element positions, the children of an element are
+#           children[child_start:child_start + child_count]
+# names: NAME entries parallel to children, the children of an element
+#        sorted by name, for lookup by binary search
+# adjacency: int32 edge positions, for activity nodes the outgoing edges at
+#            out_start and the incoming edges at in_start
+# strings: a STRING (offset, length) per string into the UTF-8 string data
+# uuids: UUID entries sorted by uuid, for lookup by binary search
+# xmiids: XMIID entries sorted by xmiid, for lookup by binary search
+#
+# RECORD fields a, b and c depend on the class:
+#   ActivityEdge -> source element, target element, guard string
+#   Constraint   -> -, -, specification string
+#   Stereotype   -> profile element, -, -
+#   StereotypeApplication
+#                -> profile element, definition element, -
+#                   with all tagged values, inherited or overridden, as
+#                   children
+#   TaggedValue  -> -, -, value string
+# strings and elements not given are -1.
+MAGIC = 'AMMM'
+VERSION = 2
+HEADER = struct.Struct('<4sHHQQQQQQQQQQQ')
+RECORD = struct.Struct('<B3xiiiiiiiiiiii16s')
+STRING = struct.Struct('<QI')
+UUID = struct.Struct('<16si')
+XMIID = struct.Struct('<ii')
+NAME = struct.Struct('<ii')
+INT = struct.Struct('<i')
+
+
+def _int32(values):
+    data = array('i', values)
+    if data.itemsize != 4:
+        data = array('l', values)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data.tostring()
+
+
+def dumps(model):
+    """Mappable representation of model as string.
+    """
+    elements = list()
+    for node in _subtree(model):
+        elements.append(node)
+        if IStereotypeApplication.providedBy(node):
+            # overridden tagged values are no children of the application
+            elements.extend(node._overridden())
+    positions = dict([(node.uuid, i) for i, node in enumerate(elements)])
+    strings = _Strings()
+    string = lambda value: strings(encode(value))
+    children = list()
+    names = list()
+    adjacency = list()
+    records = list()
+    for node in elements:
+        try:
+            code = _CODES[node.__class__]
+        except KeyError:
+            raise ValueError, u"Can't map %s, unknown class" % str(node)
+        parent = -1
+        if node is not model:
+            parent = positions[node.__parent__.uuid]
+        child_start = len(children)
+        if IStereotypeApplication.providedBy(node):
+            # inherited tagged values are recorded as children of both
+            # definition and application
+            values = node.taggedvalues
+        else:
+            values = node.values()
+        children.extend([positions[child.uuid] for child in values])
+        named = [(encode(child.__name__), string(child.__name__),
+                  positions[child.uuid]) for child in values]
+        named.sort()
+        names.extend([NAME.pack(sid, i) for name, sid, i in named])
+        a = b = c = -1
+        out_start = out_count = in_start = in_count = -1
+        if IActivityEdge.providedBy(node):
+            a = positions.get(node.source_uuid, -1)
+            b = positions.get(node.target_uuid, -1)
+            c = string(node.guard)
+        elif IConstraint.providedBy(node):
+            c = string(node.specification)
+        elif IStereotype.providedBy(node):
+            a = positions.get(node.profile.uuid, -1)
+            if IStereotypeApplication.providedBy(node):
+                b = positions.get(node.definition.uuid, -1)
+        elif ITaggedValue.providedBy(node):
+            c = string(node.value)
+        elif IActivityNode.providedBy(node) \
+          and IActivity.providedBy(node.__parent__):
+            edges = [positions[edge.uuid] for edge in node.outgoing_edges]
+            out_start, out_count = len(adjacency), len(edges)
+            adjacency.extend(edges)
+            edges = [positions[edge.uuid] for edge in node.incoming_edges]
+            in_start, in_count = len(adjacency), len(edges)
+            adjacency.extend(edges)
+        records.append(RECORD.pack(
+            code, parent, string(node.__name__), string(node.xmiid),
+            child_start, len(children) - child_start, a, b, c,
+            out_start, out_count, in_start, in_count, node.uuid.bytes))
+    data = list()
+    offsets = list()
+    position = 0
+    for value in strings.strings:
+        offsets.append(STRING.pack(position, len(value)))
+        data.append(value)
+        position += len(value)
+    uuids = [UUID.pack(node.uuid.bytes, i) for i, node in enumerate(elements)]
+    uuids.sort()
+    xmiids = [(encode(node.xmiid), string(node.xmiid), i) \
+              for i, node in enumerate(elements) if node.xmiid is not None]
+    xmiids.sort()
+    xmiids = [XMIID.pack(sid, i) for xmiid, sid, i in xmiids]
+    sections = [''.join(records), _int32(children), ''.join(names),
+                _int32(adjacency), ''.join(offsets), ''.join(data),
+                ''.join(uuids), ''.join(xmiids)]
+    starts = list()
+    position = HEADER.size
+    for section in sections:
+        starts.append(position)
+        position += len(section)
+    header = HEADER.pack(MAGIC, VERSION, 0, len(elements), starts[0],
+                         starts[1], starts[2], starts[3],
+                         len(strings.strings), starts[4], starts[5],
+                         starts[6], len(xmiids), starts[7])
+    return header + ''.join(sections)
+
+
+def dump(model, out):
+    """Write the mappable representation of model to out, a file name or
+    file object.
+    """
+    data = dumps(model)
+    if isinstance(out, basestring):
+        out = open(out, 'wb')
+        try:
+            out.write(data)
+        finally:
+            out.close()
+        return
+    out.write(data)
+
+
+class MappedModel(object):
+    """Read-only model backed by a memory mapped file.
+
+    Nothing is read up front, elements are decoded in place from the mapped
+    file when accessed. Processes mapping the same file share one copy of it
+    in memory. The elements returned are lightweight views, see
+    MappedElement.
+    """
+
+    def __init__(self, source):
+        if isinstance(source, basestring):
+            source = open(source, 'rb')
+            try:
+                self._map = mmap.mmap(source.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            finally:
+                source.close()
+        else:
+            self._map = mmap.mmap(source.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        try:
+            header = self._header()
+        except:
+            self._map.close()
+            raise
+        self._count, self._elements, self._children, self._names, \
+            self._adjacency, self._string_count, self._strings, self._data, \
+            self._uuids, self._xmiid_count, self._xmiids = header[3:]
+        # compiled guards and specifications by string id, per process
+        self._codes = dict()
+
+    def _header(self):
+        try:
+            header = HEADER.unpack_from(self._map)
+        except struct.error:
+            header = (None, None)
+        if header[0] != MAGIC:
+            raise ValueError, u"Not a mapped model"
+        if header[1] != VERSION:
+            raise ValueError, \
+                  u"Unsupported mapped model version %s" % header[1]
+        return header
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        self._map.close()
+
+    @property
+    def root(self):
+        return self.element(0)
+
+    def element(self, i):
+        """View of the element at position i in tree order.
+        """
+        if i < 0 or i >= self._count:
+            raise IndexError, i
+        return _VIEWS[self._record(i)[0]](self, i)
+
+    def node(self, uuid):
+        """The element with uuid, or None.
+        """
+        key = uuid.bytes
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found, i = UUID.unpack_from(self._map,
+                                        self._uuids + mid * UUID.size)
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                return self.element(i)
+        return None
+
+    def get_element_by_xmiid(self, xmiid):
+        """The element with xmiid, or None.
+        """
+        key = encode(xmiid)
+        lo, hi = 0, self._xmiid_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            sid, i = XMIID.unpack_from(self._map,
+                                       self._xmiids + mid * XMIID.size)
+            found = self._string(sid)
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                return self.element(i)
+        return None
+
+    def _child(self, start, count, name):
+        """Position of the child called name of the element with the
+        children at start, or None.
+        """
+        lo, hi = start, start + count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            sid, i = NAME.unpack_from(self._map, self._names + mid * NAME.size)
+            found = self._string(sid)
+            if found < name:
+                lo = mid + 1
+            elif found > name:
+                hi = mid
+            else:
+                return i
+        return None
+
+    ### decoding
+    def _record(self, i):
+        return RECORD.unpack_from(self._map, self._elements + i * RECORD.size)
+
+    def _string(self, sid):
+        if sid == -1:
+            return None
+        offset, length = STRING.unpack_from(self._map,
+                                            self._strings + sid * STRING.size)
+        offset += self._data
+        return self._map[offset:offset + length]
+
+    def _ints(self, table, start, count):
+        return [INT.unpack_from(self._map, table + (start + j) * 4)[0] \
+                for j in xrange(count)]
+
+
+
+def load(source):
+    """Map the model in source, a file name or file object, and return its
+    root package.
+    """
+    return MappedModel(source).root
+
+
+class MappedElement(ElementView):
+    """Read-only view of an element of a mapped model, see ElementView.
+
+    Strings are returned as UTF-8 encoded str, tagged values as strings.
+    """
+
+    def __init__(self, model, i):
+        self._model = model
+        self._i = i
+
+    @property
+    def _record(self):
+        return self._model._record(self._i)
+
+    # compiled guards and specifications by string id
+    @property
+    def _code_key(self):
+        return self._record[8]
+
+    @property
+    def element_class(self):
+        """The model element class viewed.
+        """
+        return CLASSES[self._record[0]]
+
+    @property
+    def __name__(self):
+        return self._model._string(self._record[2])
+
+    @property
+    def __parent__(self):
+        parent = self._record[1]
+        if parent == -1:
+            return None
+        return self._model.element(parent)
+
+    @property
+    def uuid(self):
+        return uuid.UUID(bytes=self._record[13])
+
+    @property
+    def xmiid(self):
+        return self._model._string(self._record[3])
+
+    ### children
+    def _child_positions(self):
+        record = self._record
+        return self._model._ints(self._model._children, record[4], record[5])
+
+    def __len__(self):
+        return self._record[5]
+
+    def keys(self):
+        model = self._model
+        return [model._string(model._record(i)[2]) \
+                for i in self._child_positions()]
+
+    def values(self):
+        element = self._model.element
+        return [element(i) for i in self._child_positions()]
+
+    def get(self, key, default=None):
+        record = self._record
+        i = self._model._child(record[4], record[5], encode(key))
+        if i is None:
+            return default
+        return self._model.element(i)
+
+    def filtereditems(self, interface):
+        model = self._model
+        for i in self._child_positions():
+            if interface.implementedBy(CLASSES[model._record(i)[0]]):
+                yield model.element(i)
+
+
+class MappedPackage(PackageView, MappedElement):
+    pass
+
+
+class MappedActivity(ActivityView, MappedElement):
+
+    @property
+    def edges(self):
+        return list(self.filtereditems(IActivityEdge))
+
+
+class MappedActivityNode(ActivityNodeView, MappedElement):
+
+    def _adjacent(self, start, count):
+        if count == -1:
+            return list()
+        model = self._model
+        return [model.element(i) \
+                for i in model._ints(model._adjacency, start, count)]
+
+    @property
+    def outgoing_edges(self):
+        record = self._record
+        return self._adjacent(record[9], record[10])
+
+    @property
+    def incoming_edges(self):
+        record = self._record
+        return self._adjacent(record[11], record[12])
+
+
+class MappedDecisionNode(DecisionNodeView, MappedActivityNode):
+    pass
+
+
+class MappedActivityEdge(ActivityEdgeView, MappedElement):
+
+    def _endpoint(self, i):
+        if i == -1:
+            return None
+        return self._model.element(i)
+
+    @property
+    def source(self):
+        return self._endpoint(self._record[6])
+
+    @property
+    def target(self):
+        return self._endpoint(self._record[7])
+
+    @property
+    def guard(self):
+        return self._model._string(self._record[8])
+
+
+class MappedConstraint(ConstraintView, MappedElement):
+
+    @property
+    def specification(self):
+        return self._model._string(self._record[8])
+
+
+class MappedStereotype(MappedElement):
+
+    @property
+    def profile(self):
+        i = self._record[6]
+        if i == -1:
+            return None
+        return self._model.element(i)
+
+    @property
+    def definition(self):
+        """The stereotype defined in the profile for applications of it,
+        else None.
+        """
+        i = self._record[7]
+        if i == -1:
+            return None
+        return self._model.element(i)
+
+    @property
+    def taggedvalues(self):
+        return list(self.filtereditems(ITaggedValue))
+
+
+class MappedTaggedValue(MappedElement):
+
+    @property
+    def value(self):
+        return self._model._string(self._record[8])
+
+
+# view class per class code
+_VIEWS = view_classes([(IPackage, MappedPackage),
+                       (IActivity, MappedActivity),
+                       (IDecisionNode, MappedDecisionNode),
+                       (IActivityNode, MappedActivityNode),
+                       (IActivityEdge, MappedActivityEdge),
+                       (IConstraint, MappedConstraint),
+                       (IStereotype, MappedStereotype),
+                       (ITaggedValue, MappedTaggedValue)], MappedElement)
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+import threading
+
+from activities.metamodel import snapshot
+from activities.metamodel.elements import _subtree
+from activities.metamodel.interfaces import ActivitiesException
+from activities.metamodel.interfaces import IActivityEdge
+from activities.metamodel.interfaces import IConstraint
+from activities.metamodel.interfaces import IStereotypeApplication
+
+# Immutable published versions of a model, for readers in other threads.
+#
+# A writer edits its own working model and publishes it: the model is
+# validated and copied by a snapshot, the copy is made read only and
+# replaces the version published before in a single assignment. Readers
+# take the current version without locking and keep a consistent model for
+# as long as they use it, later versions never change it.
+#
+# Elements of published versions are switched to read only subclasses of
+# their classes. Changing children or attributes raises
+# ReadOnlyModelException. Only the volatile _v_ caches are written, they
+# are filled when publishing already. Validating a published version skips
+# the bookkeeping of validation: its adjacency index is complete and it has
+# no changes to record.
+
+# methods changing elements in place
+_MUTATORS = (
+    '__setitem__', '__delitem__', '_insert_many', 'clear', 'pop', 'popitem',
+    'setdefault', 'update', 'alter_key', 'swap', 'sort', 'insertbefore',
+    'insertafter', 'insertfirst', 'insertlast', 'movebefore', 'moveafter',
+    'movefirst', 'movelast', 'override', 'reset', 'add_stereotype',
+)
+
+# methods of validation updating the index and change tracking
+_BOOKKEEPING = ('_reindex', '_set_validated')
+
+
+class ReadOnlyModelException(ActivitiesException):
+    pass
+
+
+def _refuse(self, *args, **kw):
+    raise ReadOnlyModelException,\
+          str(self) + " " +\
+          "Published models are read only"
+
+def _skip(self, *args):
+    pass
+
+# element class -> read only subclass
+_classes = dict()
+_read_only_classes = set()
+_classes_lock = threading.Lock()
+
+def _read_only_class(cls):
+    read_only = _classes.get(cls)
+    if read_only is not None:
+        return read_only
+    _classes_lock.acquire()
+    try:
+        read_only = _classes.get(cls)
+        if read_only is None:
+            def __setattr__(self, name, value):
+                if not name.startswith('_v_'):
+                    _refuse(self)
+                cls.__setattr__(self, name, value)
+            namespace = dict(__slots__=(), __module__=cls.__module__,
+                             __setattr__=__setattr__)
+            for name in _MUTATORS:
+                if hasattr(cls, name):
+                    namespace[name] = _refuse
+            for name in _BOOKKEEPING:
+                if hasattr(cls, name):
+                    namespace[name] = _skip
+            # same name, read only versions look like the elements they are
+            read_only = type(cls.__name__, (cls,), namespace)
+            if cls in snapshot._CODES:
+                snapshot._CODES[read_only] = snapshot._CODES[cls]
+            _read_only_classes.add(read_only)
+            _classes[cls] = read_only
+    finally:
+        _classes_lock.release()
+    return read_only
+
+
+def _nodes(model):
+    """model and all elements below it, with the tagged values overridden by
+    stereotype applications.
+    """
+    for node in _subtree(model):
+        yield node
+        if IStereotypeApplication.providedBy(node):
+            for taggedvalue in node._overridden():
+                yield taggedvalue
+
+
+def read_only(model):
+    """Make model and all elements below it read only, in place.
+    """
+    nodes = list(_nodes(model))
+    for node in nodes:
+        # resolve and compile up front, readers find the caches filled
+        if IActivityEdge.providedBy(node):
+            node.source, node.target, node.guard_code
+        elif IConstraint.providedBy(node):
+            node.specification_code
+    for node in nodes:
+        if node.__class__ not in _read_only_classes:
+            node.__class__ = _read_only_class(node.__class__)
+    return model
+
+
+def is_read_only(node):
+    return node.__class__ in _read_only_classes
+
+
+def publish(model):
+    """Validated read only copy of model.
+    """
+    return read_only(snapshot.loads(snapshot.dumps(model)))
+
+
+class Publisher(object):
+    """Publishes versions of the working model of a writer.
+
+    current is the version published last, version its number, starting at
+    1. Read published to get both at once. Only the writer uses model, which
+    readers never see.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._lock = threading.Lock()
+        self.published = (0, None)
+        self.publish()
+
+    @property
+    def current(self):
+        return self.published[1]
+
+    @property
+    def version(self):
+        return self.published[0]
+
+    def publish(self):
+        """Publish the working model as the next version.
+
+        Raises ModelIllFormedException if the working model is invalid, the
+        current version stays published then.
+        """
+        self._lock.acquire()
+        try:
+            published = publish(self.model)
+            # readers see the old or the new version, never a mix
+            self.published = (self.published[0] + 1, published)
+        finally:
+            self._lock.release()
+        return published
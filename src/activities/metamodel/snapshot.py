@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+import marshal
+import struct
+import uuid
+
+from activities.metamodel.compact import EXPANDED
+from activities.metamodel.compact import StereotypeApplication
+from activities.metamodel.elements import Activity
+from activities.metamodel.elements import ActivityEdge
+from activities.metamodel.elements import ActivityFinalNode
+from activities.metamodel.elements import Constraint
+from activities.metamodel.elements import DecisionNode
+from activities.metamodel.elements import FlowFinalNode
+from activities.metamodel.elements import ForkNode
+from activities.metamodel.elements import InitialNode
+from activities.metamodel.elements import JoinNode
+from activities.metamodel.elements import MergeNode
+from activities.metamodel.elements import OpaqueAction
+from activities.metamodel.elements import Package
+from activities.metamodel.elements import PostConstraint
+from activities.metamodel.elements import PreConstraint
+from activities.metamodel.elements import Profile
+from activities.metamodel.elements import Stereotype
+from activities.metamodel.elements import TaggedValue
+from activities.metamodel.elements import validate as validate_model
+from activities.metamodel.interfaces import IActivity
+from activities.metamodel.variant import ActivityVariant
+
+# Layout: header, then the marshalled tuple (strings, records).
+#
+# header: magic, format version, marshal version, flags
+# strings: names, xmiids, guards and specifications, each stored once
+# records: one tuple per node in tree order,
+#          (class, parent record, name, uuid bytes, xmiid, extra)
+#          with names and xmiids as positions in strings, -1 for None.
+#          extra depends on the class:
+#          ActivityEdge -> (source uuid bytes, target uuid bytes, guard)
+#          Constraint   -> specification
+#          Stereotype   -> record of the profile, or its uuid bytes if
+#                          stored external, see _dumps
+#          TaggedValue  -> the value itself
+#          StereotypeApplication
+#                       -> (record or uuid bytes of the definition,
+#                           overridden tagged values as (name, value) pairs)
+MAGIC = 'AMSN'
+VERSION = 1
+HEADER = struct.Struct('>4sHBB')
+
+# the snapshot was written from a validated model
+VALID = 1
+
+# the position of a class is its code in the records, append only
+CLASSES = (
+    Package,
+    Profile,
+    Activity,
+    OpaqueAction,
+    InitialNode,
+    ActivityFinalNode,
+    FlowFinalNode,
+    DecisionNode,
+    ForkNode,
+    JoinNode,
+    MergeNode,
+    ActivityEdge,
+    Constraint,
+    PreConstraint,
+    PostConstraint,
+    Stereotype,
+    TaggedValue,
+    StereotypeApplication,
+)
+
+_CODES = dict([(cls, code) for code, cls in enumerate(CLASSES)])
+# compact elements are stored as the elements they stand for
+for _compact, _cls in EXPANDED.items():
+    _CODES[_compact] = _CODES[_cls]
+# variants are stored as the activities they are equal to
+_CODES[ActivityVariant] = _CODES[Activity]
+_EDGE = _CODES[ActivityEdge]
+_STEREOTYPE = _CODES[Stereotype]
+_TAGGEDVALUE = _CODES[TaggedValue]
+_APPLICATION = _CODES[StereotypeApplication]
+_CONSTRAINTS = (_CODES[Constraint], _CODES[PreConstraint],
+                _CODES[PostConstraint])
+
+
+class _Strings(object):
+    """String table, storing each distinct string once.
+    """
+
+    def __init__(self):
+        self.strings = list()
+        self._positions = dict()
+
+    def __call__(self, value):
+        if value is None:
+            return -1
+        position = self._positions.get(value)
+        if position is None:
+            position = self._positions[value] = len(self.strings)
+            self.strings.append(value)
+        return position
+
+
+def _bytes(value):
+    if value is None:
+        return None
+    return value.bytes
+
+
+def encode(value):
+    """value as str, unicode encoded in UTF-8. None stays None.
+
+    The string encoding of the mapped and SQL stores.
+    """
+    if value is None:
+        return None
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def dumps(model, validate=True):
+    """Snapshot of model as string.
+
+    If validate is True, the model is validated first and the snapshot is
+    flagged valid, so loading it skips validation.
+    """
+    flags = 0
+    if validate:
+        validate_model(model)
+        flags |= VALID
+    return _dumps(model, flags)
+
+
+def _dumps(model, flags, prune=None, external=False):
+    """Snapshot of model with the given flags.
+
+    Nodes for which prune is true are stored without the nodes below them.
+    If external is True, stereotypes may apply profiles and definitions
+    outside of model, they are stored by uuid bytes and resolved on load.
+    """
+    strings = _Strings()
+    records = list()
+    positions = dict()
+    stack = [model]
+    while stack:
+        node = stack.pop()
+        try:
+            code = _CODES[node.__class__]
+        except KeyError:
+            raise ValueError, \
+                  u"Can't snapshot %s, unknown class" % str(node)
+        parent = -1
+        if node is not model:
+            parent = positions[node.__parent__.uuid]
+        positions[node.uuid] = len(records)
+        extra = None
+        if code == _EDGE:
+            extra = (_bytes(node.source_uuid), _bytes(node.target_uuid),
+                     strings(node.guard))
+        elif code in _CONSTRAINTS:
+            extra = strings(node.specification)
+        elif code == _STEREOTYPE:
+            extra = node.profile.uuid
+        elif code == _TAGGEDVALUE:
+            extra = node.value
+        elif code == _APPLICATION:
+            extra = (node.definition.uuid,
+                     tuple(sorted(node.overrides.items())))
+        records.append((code, parent, strings(node.__name__), node.uuid.bytes,
+                        strings(node.xmiid), extra))
+        if node is model or prune is None or not prune(node):
+            children = node.values()
+            children.reverse()
+            stack.extend(children)
+    for i, record in enumerate(records):
+        if record[0] == _STEREOTYPE:
+            profile = positions.get(record[5])
+            if profile is None and external:
+                profile = record[5].bytes
+            if profile is None:
+                raise ValueError, \
+                      u"Can't snapshot stereotype %s, its profile is not " \
+                      u"part of the model" % strings.strings[record[2]]
+            records[i] = record[:5] + (profile,)
+        elif record[0] == _APPLICATION:
+            definition = positions.get(record[5][0])
+            if definition is None and external:
+                definition = record[5][0].bytes
+            if definition is None:
+                raise ValueError, \
+                      u"Can't snapshot stereotype %s, its definition is " \
+                      u"not part of the model" % strings.strings[record[2]]
+            records[i] = record[:5] + ((definition, record[5][1]),)
+    header = HEADER.pack(MAGIC, VERSION, marshal.version, flags)
+    return header + marshal.dumps((strings.strings, records), marshal.version)
+
+
+def loads(data, validate=True):
+    """Model from snapshot data.
+
+    Snapshots flagged valid are not validated again, the activities track
+    changes for revalidate right away. Other snapshots are validated if
+    validate is True.
+    """
+    return _loads(data, validate)[0]
+
+
+def _loads(data, validate=True, root=None, resolve=None):
+    """Nodes of snapshot data, as list in the order of the records.
+
+    If root is given, the nodes below the first record are inserted into
+    root instead of a new node. resolve(uuid) finds the profiles and
+    definitions stored external.
+    """
+    try:
+        magic, version, marshal_version, flags = \
+            HEADER.unpack_from(data)
+    except struct.error:
+        magic = None
+    if magic != MAGIC:
+        raise ValueError, u"Not a model snapshot"
+    if version != VERSION:
+        raise ValueError, u"Unsupported snapshot version %s" % version
+    if marshal_version > marshal.version:
+        raise ValueError, \
+              u"Unsupported marshal version %s" % marshal_version
+    strings, records = marshal.loads(data[HEADER.size:])
+    def string(position):
+        if position == -1:
+            return None
+        return strings[position]
+    # edges share the uuid objects of their endpoints
+    uuids = dict()
+    def uuid_of(uuid_bytes):
+        value = uuids.get(uuid_bytes)
+        if value is None:
+            value = uuids[uuid_bytes] = uuid.UUID(bytes=uuid_bytes)
+        return value
+    nodes = [None] * len(records)
+    def reference(extra, name):
+        if isinstance(extra, int):
+            return nodes[extra]
+        node = None
+        if resolve is not None:
+            node = resolve(uuid_of(extra))
+        if node is None:
+            raise ValueError, \
+                  u"Can't load stereotype %s, its profile or definition " \
+                  u"is not part of the model" % name
+        return node
+    children = dict()
+    overrides = list()
+    # stereotypes are created after their profile, applications after
+    # their definition
+    for position in _stereotypes_last(records):
+        code, parent, name, uuid_bytes, xmiid, extra = records[position]
+        if parent == -1 and root is not None:
+            nodes[position] = root
+            continue
+        cls = CLASSES[code]
+        if code == _EDGE:
+            node = cls(guard=string(extra[2]))
+            if extra[0] is not None:
+                node.source_uuid = uuid_of(extra[0])
+            if extra[1] is not None:
+                node.target_uuid = uuid_of(extra[1])
+        elif code in _CONSTRAINTS:
+            node = cls(specification=string(extra))
+        elif code == _STEREOTYPE:
+            node = cls(profile=reference(extra, string(name)))
+        elif code == _TAGGEDVALUE:
+            node = cls(value=extra)
+        elif code == _APPLICATION:
+            # overrides are set once the definition has its tagged values
+            node = cls(definition=reference(extra[0], string(name)))
+            overrides.append((node, extra[1]))
+        else:
+            node = cls()
+        if parent == -1:
+            node.uuid = uuid_of(uuid_bytes)
+            node.__name__ = string(name)
+            # a root package indexes its own xmiid
+            node.xmiid = string(xmiid)
+        else:
+            # the node is registered in the indexes of the model on
+            # insertion
+            node._uuid = uuid_of(uuid_bytes)
+            node._xmiid = string(xmiid)
+            children.setdefault(parent, list()).append((position,
+                                                        string(name), node))
+        nodes[position] = node
+    # insert top down, each node is inserted into a model once
+    for position in sorted(children.keys()):
+        items = children[position]
+        items.sort()
+        nodes[position]._insert_many([(name, node) \
+                                      for i, name, node in items])
+    for node, items in overrides:
+        for key, value in items:
+            node.override(key, value)
+    if flags & VALID:
+        for node in nodes:
+            if IActivity.providedBy(node):
+                node._set_validated(True)
+    elif validate:
+        validate_model(nodes[0])
+    return nodes
+
+
+def _stereotypes_last(records):
+    stereotypes = list()
+    applications = list()
+    for position, record in enumerate(records):
+        if record[0] == _STEREOTYPE:
+            stereotypes.append(position)
+            continue
+        if record[0] == _APPLICATION:
+            applications.append(position)
+            continue
+        yield position
+    for position in stereotypes + applications:
+        yield position
+
+
+def dump(model, out, validate=True):
+    """Write a snapshot of model to out, a file name or file object.
+    """
+    data = dumps(model, validate=validate)
+    if isinstance(out, basestring):
+        out = open(out, 'wb')
+        try:
+            out.write(data)
+        finally:
+            out.close()
+        return
+    out.write(data)
+
+
+def load(source, validate=True):
+    """Read a model snapshot from source, a file name or file object.
+    """
+    if isinstance(source, basestring):
+        source = open(source, 'rb')
+        try:
+            return loads(source.read(), validate=validate)
+        finally:
+            source.close()
+    return loads(source.read(), validate=validate)
@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+import sqlite3
+import uuid
+
+from activities.metamodel.elements import _marker
+from activities.metamodel.elements import _subtree
+from activities.metamodel.interfaces import IActivity
+from activities.metamodel.interfaces import IActivityEdge
+from activities.metamodel.interfaces import IActivityNode
+from activities.metamodel.interfaces import IConstraint
+from activities.metamodel.interfaces import IDecisionNode
+from activities.metamodel.interfaces import IPackage
+from activities.metamodel.interfaces import IStereotype
+from activities.metamodel.interfaces import IStereotypeApplication
+from activities.metamodel.interfaces import ITaggedValue
+from activities.metamodel.snapshot import CLASSES
+from activities.metamodel.snapshot import _CODES
+from activities.metamodel.snapshot import encode
+from activities.metamodel.views import ActivityEdgeView
+from activities.metamodel.views import ActivityNodeView
+from activities.metamodel.views import ActivityView
+from activities.metamodel.views import ConstraintView
+from activities.metamodel.views import DecisionNodeView
+from activities.metamodel.views import ElementView
+from activities.metamodel.views import PackageView
+from activities.metamodel.views import view_classes
+
+# Model stored in a SQLite database and queried in place.
+#
+# Elements are identified by their position in tree order, the root is 0.
+# Tables:
+# elements:    class code, parent, name, uuid bytes, xmiid, the enclosing
+#              activity, and value, the specification of constraints or
+#              the value of tagged values
+# edges:       activity, source element, target element and guard of edges
+# stereotypes: profile element, definition element and name of stereotypes
+# Tagged values overridden by applications are children of the application,
+# the tagged values inherited are children of the definition only.
+#
+# The database version is kept in user_version, 0 for empty databases.
+VERSION = 1
+
+_TABLES = (
+    "CREATE TABLE elements ("
+    "id INTEGER PRIMARY KEY, class INTEGER NOT NULL, parent INTEGER, "
+    "name TEXT, uuid BLOB NOT NULL, xmiid TEXT, activity INTEGER, value)",
+    "CREATE TABLE edges ("
+    "id INTEGER PRIMARY KEY, activity INTEGER, source INTEGER, "
+    "target INTEGER, guard TEXT)",
+    "CREATE TABLE stereotypes ("
+    "id INTEGER PRIMARY KEY, profile INTEGER, definition INTEGER, "
+    "name TEXT)",
+)
+
+# created after the bulk import
+_INDEXES = (
+    "CREATE INDEX elements_parent ON elements (parent, name)",
+    "CREATE UNIQUE INDEX elements_uuid ON elements (uuid)",
+    "CREATE INDEX elements_xmiid ON elements (xmiid)",
+    "CREATE INDEX elements_activity ON elements (activity)",
+    "CREATE INDEX edges_activity ON edges (activity)",
+    "CREATE INDEX edges_source ON edges (source)",
+    "CREATE INDEX edges_target ON edges (target)",
+    "CREATE INDEX stereotypes_name ON stereotypes (name, profile)",
+)
+
+_COLUMNS = "e.id, e.class, e.parent, e.name, e.uuid, e.xmiid, e.activity, " \
+           "e.value, d.source, d.target, d.guard"
+_SELECT = "SELECT " + _COLUMNS + \
+          " FROM elements e LEFT JOIN edges d ON d.id = e.id"
+# edges by activity, source or target
+_EDGES = "SELECT " + _COLUMNS + \
+         " FROM edges d JOIN elements e ON e.id = d.id" \
+         " WHERE d.%s = ? ORDER BY d.id"
+# row fields
+_ID, _CLASS, _PARENT, _NAME, _UUID, _XMIID, _ACTIVITY, _VALUE, \
+    _SOURCE, _TARGET, _GUARD = range(11)
+
+
+def _value(value):
+    if value is None or isinstance(value, (int, long, float)):
+        return value
+    return encode(value)
+
+
+def _elements(model):
+    elements = list()
+    for node in _subtree(model):
+        elements.append(node)
+        if IStereotypeApplication.providedBy(node):
+            # overridden tagged values are no children of the application
+            elements.extend(node._overridden())
+    return elements
+
+
+def _import(connection, model):
+    if connection.execute("PRAGMA user_version").fetchone()[0]:
+        raise ValueError, u"The database holds a model already"
+    elements = _elements(model)
+    ids = dict([(node.uuid, i) for i, node in enumerate(elements)])
+    # element id -> id of the enclosing activity
+    activities = dict()
+    rows = list()
+    edges = list()
+    stereotypes = list()
+    for i, node in enumerate(elements):
+        try:
+            code = _CODES[node.__class__]
+        except KeyError:
+            raise ValueError, u"Can't store %s, unknown class" % str(node)
+        parent = activity = value = None
+        if node is not model:
+            parent = ids[node.__parent__.uuid]
+            activity = activities.get(parent)
+            if IActivity.providedBy(node.__parent__):
+                activity = parent
+        activities[i] = activity
+        if IActivityEdge.providedBy(node):
+            edges.append((i, activity, ids.get(node.source_uuid),
+                          ids.get(node.target_uuid), encode(node.guard)))
+        elif IConstraint.providedBy(node):
+            value = encode(node.specification)
+        elif IStereotype.providedBy(node):
+            definition = None
+            if IStereotypeApplication.providedBy(node):
+                definition = ids.get(node.definition.uuid)
+            stereotypes.append((i, ids.get(node.profile.uuid), definition,
+                                encode(node.__name__)))
+        elif ITaggedValue.providedBy(node):
+            value = _value(node.value)
+        rows.append((i, code, parent, encode(node.__name__),
+                     buffer(node.uuid.bytes), encode(node.xmiid), activity,
+                     value))
+    connection.text_factory = str
+    cursor = connection.cursor()
+    try:
+        for statement in _TABLES:
+            cursor.execute(statement)
+        cursor.executemany("INSERT INTO elements VALUES (?, ?, ?, ?, ?, ?, "
+                           "?, ?)", rows)
+        cursor.executemany("INSERT INTO edges VALUES (?, ?, ?, ?, ?)", edges)
+        cursor.executemany("INSERT INTO stereotypes VALUES (?, ?, ?, ?)",
+                           stereotypes)
+        for statement in _INDEXES:
+            cursor.execute(statement)
+        cursor.execute("PRAGMA user_version = %i" % VERSION)
+        connection.commit()
+    except:
+        connection.rollback()
+        raise
+
+
+def dump(model, path):
+    """Import model in bulk into a new SQLite database at path.
+    """
+    connection = sqlite3.connect(path)
+    try:
+        _import(connection, model)
+    finally:
+        connection.close()
+
+
+class SQLModel(object):
+    """Read-only model stored in a SQLite database.
+
+    Nothing is read up front, elements are queried when accessed. Adjacency
+    of nodes, lookups by uuid and xmiid, and stereotypes are answered by
+    indexed queries. The elements returned are lightweight views, see
+    SQLElement.
+    """
+
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path)
+        self._connection.text_factory = str
+        version = self._connection.execute("PRAGMA user_version").fetchone()
+        if version[0] != VERSION:
+            self._connection.close()
+            if not version[0]:
+                raise ValueError, u"Not a model database"
+            raise ValueError, \
+                  u"Unsupported model database version %s" % version[0]
+        # compiled guards and specifications
+        self._codes = dict()
+
+    def __len__(self):
+        return self._connection.execute(
+            "SELECT count(*) FROM elements").fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+    @property
+    def root(self):
+        return self.element(0)
+
+    def element(self, i):
+        """View of the element at position i in tree order.
+        """
+        found = self._query("e.id = ?", (i,))
+        if not found:
+            raise IndexError, i
+        return found[0]
+
+    def node(self, uuid):
+        """The element with uuid, or None.
+        """
+        found = self._query("e.uuid = ?", (buffer(uuid.bytes),))
+        if not found:
+            return None
+        return found[0]
+
+    def get_element_by_xmiid(self, xmiid):
+        """The element with xmiid, or None.
+        """
+        found = self._query("e.xmiid = ?", (encode(xmiid),))
+        if not found:
+            return None
+        return found[0]
+
+    def get_elements_by_stereotype(self, profile, stereotype, name=None,
+                                   value=_marker):
+        """Elements with the stereotype of given name of profile, a profile
+        element or its name, applied. See
+        activities.metamodel.get_elements_by_stereotype.
+        """
+        sql = "SELECT DISTINCT element.id FROM stereotypes s" \
+              " JOIN elements st ON st.id = s.id" \
+              " JOIN elements element ON element.id = st.parent" \
+              " JOIN elements p ON p.id = s.profile" \
+              " WHERE s.name = ? AND st.parent != s.profile"
+        args = [encode(stereotype)]
+        if isinstance(profile, SQLElement):
+            sql += " AND s.profile = ?"
+            args.append(profile._i)
+        else:
+            sql += " AND p.name = ?"
+            args.append(encode(profile))
+        if name is not None:
+            match = "tv.name = ?"
+            if value is not _marker:
+                match += " AND tv.value = ?"
+            sql += " AND (EXISTS (SELECT 1 FROM elements tv" \
+                   "  WHERE tv.parent = s.id AND %s)" \
+                   " OR (s.definition IS NOT NULL" \
+                   "  AND NOT EXISTS (SELECT 1 FROM elements tv" \
+                   "   WHERE tv.parent = s.id AND tv.name = ?)" \
+                   "  AND EXISTS (SELECT 1 FROM elements tv" \
+                   "   WHERE tv.parent = s.definition AND %s)))" % \
+                   (match, match)
+            tagged = [encode(name)]
+            if value is not _marker:
+                tagged.append(_value(value))
+            args += tagged + [encode(name)] + tagged
+        sql += " ORDER BY element.id"
+        ids = [row[0] for row in self._connection.execute(sql, args)]
+        return [self.element(i) for i in ids]
+
+    ### queries
+    def _view(self, row):
+        return _VIEWS[row[_CLASS]](self, row)
+
+    def _query(self, where, args=()):
+        rows = self._connection.execute(
+            _SELECT + " WHERE " + where + " ORDER BY e.id", args)
+        return [self._view(row) for row in rows]
+
+    def _edges(self, column, i):
+        rows = self._connection.execute(_EDGES % column, (i,))
+        return [self._view(row) for row in rows]
+
+
+def load(path):
+    """Open the model database at path and return its root package.
+    """
+    return SQLModel(path).root
+
+
+# codes of the classes implementing an interface
+_implementing = dict()
+
+def _codes(interface):
+    codes = _implementing.get(interface)
+    if codes is None:
+        codes = _implementing[interface] = \
+            ', '.join([str(code) for code, cls in enumerate(CLASSES) \
+                       if interface.implementedBy(cls)]) or '-1'
+    return codes
+
+
+class SQLElement(ElementView):
+    """Read-only view of an element of a model database, see ElementView.
+
+    Strings are returned as UTF-8 encoded str.
+    """
+
+    def __init__(self, model, row):
+        self._model = model
+        self._row = row
+        self._i = row[_ID]
+
+    # compiled guards and specifications by element
+    @property
+    def _code_key(self):
+        return self._i
+
+    @property
+    def element_class(self):
+        """The model element class viewed.
+        """
+        return CLASSES[self._row[_CLASS]]
+
+    @property
+    def __name__(self):
+        return self._row[_NAME]
+
+    @property
+    def __parent__(self):
+        parent = self._row[_PARENT]
+        if parent is None:
+            return None
+        return self._model.element(parent)
+
+    @property
+    def uuid(self):
+        return uuid.UUID(bytes=str(self._row[_UUID]))
+
+    @property
+    def xmiid(self):
+        return self._row[_XMIID]
+
+    ### children
+    def values(self):
+        return self._model._query("e.parent = ?", (self._i,))
+
+    def keys(self):
+        return [value.__name__ for value in self.values()]
+
+    def __len__(self):
+        return self._model._connection.execute(
+            "SELECT count(*) FROM elements WHERE parent = ?",
+            (self._i,)).fetchone()[0]
+
+    def get(self, key, default=None):
+        found = self._model._query("e.parent = ? AND e.name = ?",
+                                   (self._i, encode(key)))
+        if not found:
+            return default
+        return found[0]
+
+    def filtereditems(self, interface):
+        return iter(self._model._query(
+            "e.parent = ? AND e.class IN (%s)" % _codes(interface),
+            (self._i,)))
+
+
+class SQLPackage(PackageView, SQLElement):
+    pass
+
+
+class SQLActivity(ActivityView, SQLElement):
+
+    @property
+    def edges(self):
+        return self._model._edges('activity', self._i)
+
+    @property
+    def contents(self):
+        """All elements within the activity, in tree order.
+        """
+        return self._model._query("e.activity = ?", (self._i,))
+
+
+class SQLActivityNode(ActivityNodeView, SQLElement):
+
+    @property
+    def outgoing_edges(self):
+        return self._model._edges('source', self._i)
+
+    @property
+    def incoming_edges(self):
+        return self._model._edges('target', self._i)
+
+
+class SQLDecisionNode(DecisionNodeView, SQLActivityNode):
+    pass
+
+
+class SQLActivityEdge(ActivityEdgeView, SQLElement):
+
+    def _endpoint(self, i):
+        if i is None:
+            return None
+        return self._model.element(i)
+
+    @property
+    def source(self):
+        return self._endpoint(self._row[_SOURCE])
+
+    @property
+    def target(self):
+        return self._endpoint(self._row[_TARGET])
+
+    @property
+    def guard(self):
+        return self._row[_GUARD]
+
+
+class SQLConstraint(ConstraintView, SQLElement):
+
+    @property
+    def specification(self):
+        return self._row[_VALUE]
+
+
+class SQLStereotype(SQLElement):
+
+    def _stereotype(self):
+        return self._model._connection.execute(
+            "SELECT profile, definition FROM stereotypes WHERE id = ?",
+            (self._i,)).fetchone()
+
+    @property
+    def profile(self):
+        profile = self._stereotype()[0]
+        if profile is None:
+            return None
+        return self._model.element(profile)
+
+    @property
+    def definition(self):
+        """The stereotype defined in the profile for applications of it,
+        else None.
+        """
+        definition = self._stereotype()[1]
+        if definition is None:
+            return None
+        return self._model.element(definition)
+
+    @property
+    def taggedvalues(self):
+        """The tagged values, for applications the overridden ones and those
+        inherited from the definition.
+        """
+        own = list(self.filtereditems(ITaggedValue))
+        definition = self.definition
+        if definition is None:
+            return own
+        overridden = dict([(tv.__name__, tv) for tv in own])
+        return [overridden.get(tv.__name__, tv) \
+                for tv in definition.taggedvalues]
+
+
+class SQLTaggedValue(SQLElement):
+
+    @property
+    def value(self):
+        return self._row[_VALUE]
+
+
+# view class per class code
+_VIEWS = view_classes([(IPackage, SQLPackage),
+                       (IActivity, SQLActivity),
+                       (IDecisionNode, SQLDecisionNode),
+                       (IActivityNode, SQLActivityNode),
+                       (IActivityEdge, SQLActivityEdge),
+                       (IConstraint, SQLConstraint),
+                       (IStereotype, SQLStereotype),
+                       (ITaggedValue, SQLTaggedValue)], SQLElement)
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+import marshal
+import os
+import struct
+import thread
+import threading
+import weakref
+
+from activities.metamodel import snapshot
+from activities.metamodel.elements import Activity
+from activities.metamodel.elements import validate as validate_model
+from activities.metamodel.interfaces import IActivity
+from activities.metamodel.interfaces import IElement
+
+# File storage of models, with activities loaded on first use.
+#
+# Opening a stored model loads everything but the contents of its
+# activities. Activities are ghosts: GhostActivity objects with the name,
+# uuid and xmiid of the activity and its place in the model. A ghost loads
+# its nodes and edges when it is used first and becomes an Activity then.
+# Storing a model writes the activities loaded, the contents of ghosts are
+# copied from the file they were opened from. Ghosts load one at a time, a
+# ghost failing to load stays a ghost.
+#
+# The uuid, xmiid and stereotype indexes of the model only know the
+# elements of loaded activities.
+#
+# Layout: header, activity records, table
+# header: magic, format version, marshal version, offset of the table
+# activity records: snapshots of the activities, with the profiles and
+#                   definitions of their stereotypes stored external
+# table: marshalled tuple (snapshot of the model without the contents of
+#        its activities, {activity uuid bytes: (offset, length)})
+MAGIC = 'AMFS'
+VERSION = 1
+HEADER = struct.Struct('>4sHBQ')
+
+# attributes of ghosts available without loading them
+_GHOST_ATTRIBUTES = frozenset([
+    '__class__', '__dict__', '__name__', '__parent__', '__providedBy__',
+    '__provides__', '__implemented__', '__repr__', '__str__', '_index',
+    'uuid', '_uuid', 'get_uuid', 'xmiid', '_xmiid', 'get_xmiid', '_p_jar',
+    '_p_position',
+])
+
+
+class _File(object):
+    """Storage file opened, ghosts read their activities from it.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.lock = threading.Lock()
+        # ghosts given this file, by id
+        self.ghosts = weakref.WeakValueDictionary()
+        try:
+            self._check()
+        except:
+            self.file.close()
+            raise
+
+    def _check(self):
+        try:
+            magic, version, marshal_version, self.table = \
+                HEADER.unpack(self.file.read(HEADER.size))
+        except struct.error:
+            magic = None
+        if magic != MAGIC:
+            raise ValueError, u"Not a model storage"
+        if version != VERSION:
+            raise ValueError, u"Unsupported storage version %s" % version
+        if marshal_version > marshal.version:
+            raise ValueError, \
+                  u"Unsupported marshal version %s" % marshal_version
+
+    def read(self, offset, length=-1):
+        self.lock.acquire()
+        try:
+            self.file.seek(offset)
+            return self.file.read(length)
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            self.file.close()
+        finally:
+            self.lock.release()
+
+    def used(self):
+        """Whether ghosts still read from the file.
+        """
+        for ghost in self.ghosts.values():
+            if is_ghost(ghost) and ghost._p_jar is self:
+                return True
+        return False
+
+    def add(self, ghost, position):
+        ghost._p_jar = self
+        ghost._p_position = position
+        self.ghosts[id(ghost)] = ghost
+
+
+# reentrant, loading a ghost may use other ghosts
+_load_lock = threading.RLock()
+
+def _load(ghost):
+    state = dict.__getattribute__(ghost, '__dict__')
+    if state.get('_p_loading') == thread.get_ident():
+        # the ghost is filled by this thread, its contents are used as is
+        return
+    _load_lock.acquire()
+    try:
+        if ghost.__class__ is not GhostActivity:
+            # loaded by another thread meanwhile
+            return
+        offset, length = state['_p_position']
+        data = state['_p_jar'].read(offset, length)
+        # other threads wait for the ghost, it becomes an Activity when it
+        # is complete
+        state['_p_loading'] = thread.get_ident()
+        try:
+            try:
+                snapshot._loads(data, root=ghost, resolve=ghost.node)
+            except:
+                for key in Activity.keys(ghost):
+                    Activity.__delitem__(ghost, key)
+                raise
+        finally:
+            del state['_p_loading']
+        ghost.__class__ = Activity
+        del state['_p_jar']
+        del state['_p_position']
+    finally:
+        _load_lock.release()
+
+
+class GhostActivity(Activity):
+    """Activity not loaded yet, using it loads it.
+    """
+
+    def __getattribute__(self, name):
+        if name not in _GHOST_ATTRIBUTES:
+            _load(self)
+        return dict.__getattribute__(self, name)
+
+def _loading(name):
+    def method(self, *args):
+        _load(self)
+        return getattr(Activity, name)(self, *args)
+    method.__name__ = name
+    return method
+
+# called by the interpreter without attribute lookup
+for _name in ('__len__', '__iter__', '__contains__', '__getitem__',
+              '__setitem__', '__delitem__', '__eq__', '__ne__'):
+    setattr(GhostActivity, _name, _loading(_name))
+
+# ghosts are stored as the activities they stand for
+snapshot._CODES[GhostActivity] = snapshot._CODES[Activity]
+
+
+def is_ghost(node):
+    return node.__class__ is GhostActivity
+
+
+def _skeleton(model):
+    """model and the nodes below it, without the contents of activities.
+    """
+    stack = [model]
+    while stack:
+        node = stack.pop()
+        yield node
+        if IActivity.providedBy(node):
+            continue
+        children = node.values()
+        children.reverse()
+        stack.extend(children)
+
+
+class FileStorage(object):
+    """Stores a model in the file at path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # files opened, ghosts read from them
+        self._jars = list()
+
+    def _open(self):
+        jar = _File(self.path)
+        self._jars.append(jar)
+        return jar
+
+    def close(self):
+        """Close the files opened. Ghosts of the models opened can't be
+        loaded afterwards.
+        """
+        while self._jars:
+            self._jars.pop().close()
+
+    def open(self):
+        """The model stored, with its activities as ghosts.
+        """
+        jar = self._open()
+        skeleton, table = marshal.loads(jar.read(jar.table))
+        nodes = snapshot._loads(skeleton, validate=False)
+        for node in nodes:
+            if IActivity.providedBy(node):
+                node.__class__ = GhostActivity
+                jar.add(node, table[node.uuid.bytes])
+        return nodes[0]
+
+    def store(self, model, validate=True):
+        """Write model to the file, replacing the model stored before.
+
+        If validate is True, the activities loaded and the elements outside
+        of activities are validated. Ghosts of model read from the new file
+        afterwards, files no ghost reads from any more are closed.
+        """
+        nodes = list(_skeleton(model))
+        activities = [node for node in nodes if IActivity.providedBy(node)]
+        if validate:
+            for node in nodes:
+                if IActivity.providedBy(node):
+                    if not is_ghost(node):
+                        validate_model(node)
+                elif IElement.providedBy(node):
+                    node.check_model_constraints()
+        table = dict()
+        path = self.path + '.tmp'
+        out = open(path, 'wb')
+        try:
+            try:
+                out.write(HEADER.pack(MAGIC, VERSION, marshal.version, 0))
+                for activity in activities:
+                    if is_ghost(activity):
+                        data = activity._p_jar.read(*activity._p_position)
+                    else:
+                        flags = 0
+                        if validate:
+                            flags |= snapshot.VALID
+                        data = snapshot._dumps(activity, flags, external=True)
+                    table[activity.uuid.bytes] = (out.tell(), len(data))
+                    out.write(data)
+                skeleton = snapshot._dumps(model, 0,
+                                           prune=IActivity.providedBy)
+                offset = out.tell()
+                out.write(marshal.dumps((skeleton, table), marshal.version))
+                out.seek(0)
+                out.write(HEADER.pack(MAGIC, VERSION, marshal.version,
+                                      offset))
+            finally:
+                out.close()
+        except:
+            # the file stored before stays in place
+            os.remove(path)
+            raise
+        os.rename(path, self.path)
+        # no ghost loads while ghosts move to the new file
+        _load_lock.acquire()
+        try:
+            jar = None
+            for activity in activities:
+                if is_ghost(activity):
+                    if jar is None:
+                        jar = self._open()
+                    jar.add(activity, table[activity.uuid.bytes])
+            for old in list(self._jars):
+                if old is not jar and not old.used():
+                    self._jars.remove(old)
+                    old.close()
+        finally:
+            _load_lock.release()
@@ -17,6 +17,20 @@ optionflags = doctest.NORMALIZE_WHITESPACE | \
 
 TESTFILES = [
     '../elements.txt',
+    '../frozen.txt',
+    '../builder.txt',
+    '../xmi.txt',
+    '../snapshot.txt',
+    '../mapped.txt',
+    '../compact.txt',
+    '../benchmark/benchmark.txt',
+    '../instrumentation.txt',
+    '../analysis.txt',
+    '../diff.txt',
+    '../variant.txt',
+    '../published.txt',
+    '../storage.txt',
+    '../sqlstore.txt',
 ]
 
 def test_suite():
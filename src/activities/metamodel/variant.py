@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+import types
+from odict import odict
+from zodict.node import Node
+from zope.interface import providedBy
+
+from activities.metamodel import interfaces
+from activities.metamodel.elements import Activity
+from activities.metamodel.elements import ModelIllFormedException
+from activities.metamodel.elements import _metamodel_interfaces
+from activities.metamodel.interfaces import IActivity
+from activities.metamodel.interfaces import IActivityEdge
+from activities.metamodel.interfaces import IActivityNode
+from activities.metamodel.interfaces import IConstraint
+from activities.metamodel.interfaces import IStereotype
+from activities.metamodel.interfaces import IStereotypeApplication
+from activities.metamodel.interfaces import ITaggedValue
+
+# Copy-on-write variants of activities.
+#
+# A variant shares the elements of its base activity. Each element is seen
+# through a SharedElement, a slotted handle reading the element of the base,
+# but bound to the variant: its parent is the variant, edges resolve their
+# endpoints and nodes their edges in the variant. The first change of a
+# shared element, or of anything below it, copies it from the base into the
+# variant, other elements stay shared.
+#
+# Like snapshot copies, variants keep the uuids of the base elements, so a
+# variant belongs into another model than its base. The base must not be
+# changed while variants of it are in use.
+
+# volatile attributes referencing nodes, not shared with the base
+_REFERENCES = ('_v_source', '_v_target')
+
+# methods changing an element in place, it is copied before
+_WRITES = ('override', 'reset')
+
+
+def _copy(node):
+    """Copy of node and the nodes below it, with the same uuids and xmiids.
+    """
+    cls = node.__class__
+    if IActivityEdge.providedBy(node):
+        copy = cls(guard=node.guard)
+        copy.source_uuid = node.source_uuid
+        copy.target_uuid = node.target_uuid
+    elif IConstraint.providedBy(node):
+        copy = cls(specification=node.specification)
+    elif IStereotypeApplication.providedBy(node):
+        copy = cls(definition=node.definition, overrides=node.overrides)
+    elif IStereotype.providedBy(node):
+        copy = cls(profile=node.profile)
+    elif ITaggedValue.providedBy(node):
+        copy = cls(value=node.value)
+    else:
+        copy = cls()
+    copy._uuid = node.uuid
+    copy._xmiid = node.xmiid
+    for key, child in node.items():
+        copy[key] = _copy(child)
+    return copy
+
+
+def _retarget(shared, element):
+    """Let shared and the shared elements below it read element, the copy
+    of what they shared.
+    """
+    shared._base = element
+    shared._shared = False
+    shared._v_cache = None
+    for key, child in (shared._children or {}).items():
+        if isinstance(element, Node) and key in element:
+            _retarget(child, element[key])
+    shared._children = None
+
+
+class SharedElement(object):
+    """Element of a variant read from the base activity.
+
+    Provides the interfaces and the class of the element shared, and its
+    API: properties and methods of the element class are bound to the
+    shared element. Children are shared elements again. Setting attributes
+    or children copies the element into the variant first, afterwards the
+    shared element reads and writes the copy.
+    """
+    __slots__ = ('_base', '_shared', '__name__', '__parent__', '_index',
+                 '_v_cache', '_children', '__weakref__')
+
+    def __init__(self, base, name, parent, index):
+        self._base = base
+        self._shared = True
+        self.__name__ = name
+        self.__parent__ = parent
+        self._index = index
+        self._v_cache = None
+        self._children = None
+
+    __class__ = property(lambda self: self._base.__class__)
+    __providedBy__ = property(lambda self: providedBy(self._base))
+
+    def __repr__(self):
+        return Node.__dict__['__repr__'](self)
+    __str__ = __repr__
+
+    def __getattr__(self, name):
+        base = self._base
+        if not self._shared:
+            return getattr(base, name)
+        if name in _WRITES:
+            return getattr(self._materialize(), name)
+        if name.startswith('_v_'):
+            # volatile caches of the shared element, compiled guards and
+            # specifications can be used from the base
+            cache = self._v_cache
+            if cache is not None and name in cache:
+                return cache[name]
+            if name in _REFERENCES:
+                return None
+            return getattr(base, name)
+        cls = base.__class__
+        attr = getattr(cls, name, None)
+        if isinstance(attr, property):
+            return attr.__get__(self, cls)
+        if isinstance(attr, types.MethodType):
+            return types.MethodType(attr.im_func, self, cls)
+        return getattr(base, name)
+
+    def __setattr__(self, name, value):
+        if name in SharedElement.__slots__:
+            object.__setattr__(self, name, value)
+        elif not self._shared:
+            setattr(self._base, name, value)
+        elif name.startswith('_v_'):
+            if self._v_cache is None:
+                self._v_cache = dict()
+            self._v_cache[name] = value
+        else:
+            setattr(self._materialize(), name, value)
+
+    def _materialize(self):
+        """Copy the shared element into the variant, returns the copy.
+        """
+        if not self._shared:
+            return self._base
+        top = self
+        while isinstance(top.__parent__, SharedElement):
+            top = top.__parent__
+        top.__parent__._materialize(top.__name__)
+        return self._base
+
+    def _child(self, key):
+        children = self._children
+        if children is None:
+            children = self._children = dict()
+        child = children.get(key)
+        if child is None:
+            child = SharedElement(self._base[key], key, self, self._index)
+            children[key] = child
+            self._index[child.uuid] = child
+        return child
+
+    ### children, shared elements of the children of the base
+    def _container(self):
+        return self._shared and isinstance(self._base, Node)
+
+    def __len__(self):
+        return len(self._base)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key):
+        return key in self._base
+
+    def __getitem__(self, key):
+        if not self._container():
+            return self._base[key]
+        if key not in self._base:
+            raise KeyError(key)
+        return self._child(key)
+
+    def get(self, key, default=None):
+        if not self._container():
+            return self._base.get(key, default)
+        if key not in self._base:
+            return default
+        return self._child(key)
+
+    def keys(self):
+        return self._base.keys()
+
+    def values(self):
+        if not self._container():
+            return self._base.values()
+        return [self._child(key) for key in self._base.keys()]
+
+    def items(self):
+        if not self._container():
+            return self._base.items()
+        return [(key, self._child(key)) for key in self._base.keys()]
+
+    def filtereditems(self, interface):
+        if not self._container():
+            return self._base.filtereditems(interface)
+        return iter([self._child(child.__name__) \
+                     for child in self._base.filtereditems(interface)])
+
+    def filteredcount(self, interface):
+        return self._base.filteredcount(interface)
+
+    def __setitem__(self, key, val):
+        self._materialize()[key] = val
+
+    def __delitem__(self, key):
+        del self._materialize()[key]
+
+
+class ActivityVariant(Activity):
+    """Copy-on-write variant of the activity base.
+
+    Behaves like a copy of base. Its children are SharedElements until they
+    are changed, then they are copies of the elements of base. Elements
+    added are owned by the variant only.
+    """
+
+    def __init__(self, base, name=None):
+        self._base = base
+        # shared elements by key, for the children of base not changed
+        self._proxies = dict()
+        super(ActivityVariant, self).__init__(name, context=base.context)
+        index = self._index
+        for key, val in base.items():
+            proxy = SharedElement(val, key, self, index)
+            self._proxies[key] = proxy
+            index[proxy.uuid] = proxy
+
+    # the uuids of the shared elements are those of the base elements
+    def _get_index(self):
+        return self.__dict__['_uuids']
+    def _set_index(self, index):
+        base = self.__dict__.get('_base')
+        if base is not None and index.get(base.uuid) is base:
+            raise ValueError(
+                u"An ActivityVariant can't be part of the model of its base")
+        self.__dict__['_uuids'] = index
+    _index = property(_get_index, _set_index)
+
+    @property
+    def shared(self):
+        """Keys of the elements still shared with base.
+        """
+        return [key for key in self._base.keys() if key in self._proxies]
+
+    def _materialize(self, key):
+        proxy = self._proxies[key]
+        element = _copy(proxy._base)
+        self[key] = element
+        _retarget(proxy, element)
+        return element
+
+    def _unregister(self, proxy):
+        """Remove proxy and the shared elements below it from the uuid index.
+        """
+        index = self._index
+        stack = [proxy]
+        while stack:
+            node = stack.pop()
+            if index.get(node.uuid) is node:
+                del index[node.uuid]
+            stack.extend((node._children or {}).values())
+
+    def _unshare(self, key):
+        proxy = self._proxies[key]
+        self._mark_neighbours(proxy)
+        self._release(proxy)
+        self._detached(proxy)
+        self._unregister(proxy)
+        del self._proxies[key]
+        return proxy
+
+    def _release(self, node):
+        # edges must not keep resolving to the removed node
+        if IActivityNode.providedBy(node):
+            for edge in self._adjacent_edges('_incoming', node):
+                edge._v_target = None
+            for edge in self._adjacent_edges('_outgoing', node):
+                edge._v_source = None
+
+    def __setitem__(self, key, val):
+        if key in self._proxies:
+            self._unshare(key)
+        super(ActivityVariant, self).__setitem__(key, val)
+
+    def __delitem__(self, key):
+        if key in self._proxies:
+            self._unshare(key)
+            self._mark([self])
+            return
+        self._release(self[key])
+        super(ActivityVariant, self).__delitem__(key)
+
+    ### children, in the order of base, followed by the elements added.
+    ### dict and the iterators of odict give the elements owned.
+    def _owned(self):
+        return super(ActivityVariant, self).iteritems()
+
+    def keys(self):
+        keys = [key for key in self._base.keys() \
+                if key in self._proxies or dict.__contains__(self, key)]
+        shared = set(keys)
+        keys += [key for key in super(ActivityVariant, self).iterkeys() \
+                 if key not in shared]
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    iterkeys = __iter__
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def __len__(self):
+        return len(self._proxies) + dict.__len__(self)
+
+    def __contains__(self, key):
+        return key in self._proxies or dict.__contains__(self, key)
+
+    has_key = __contains__
+
+    def __getitem__(self, key):
+        proxy = self._proxies.get(key)
+        if proxy is not None:
+            return proxy
+        return super(ActivityVariant, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        return self[key]
+
+    def _rebucket(self):
+        # the buckets hold the elements owned by the variant only
+        self._buckets = dict()
+        for key, val in self._owned():
+            for iface in _metamodel_interfaces(val):
+                self._buckets.setdefault(iface, odict())[key] = val
+
+    def filtereditems(self, interface):
+        if interface.__module__ != interfaces.__name__:
+            return iter([val for val in self.values() \
+                         if interface.providedBy(val)])
+        owned = self._buckets.get(interface, {})
+        found = list()
+        placed = set()
+        for val in self._base.filtereditems(interface):
+            key = val.__name__
+            proxy = self._proxies.get(key)
+            if proxy is not None:
+                found.append(proxy)
+            elif key in owned:
+                found.append(owned[key])
+                placed.add(key)
+        found += [val for key, val in owned.items() if key not in placed]
+        return iter(found)
+
+    def filteredcount(self, interface):
+        return len(list(self.filtereditems(interface)))
+
+    ### adjacency, the edges of base shared merged with the edges owned, in
+    ### the order of the children
+    def _position(self, key):
+        position = self._base._position(key)
+        if position is not None:
+            return (0, position)
+        return (1, self._positions.get(key))
+
+    def _adjacent_edges(self, index, node):
+        proxies = self._proxies
+        shared = [proxies[edge.__name__] for edge in \
+                  self._base._adjacent_edges(index, node) \
+                  if edge.__name__ in proxies]
+        owned = getattr(self, index).get(node.uuid, ())
+        if not owned:
+            return shared
+        if not shared:
+            return list(owned)
+        position = self._position
+        edges = list()
+        i = j = 0
+        while i < len(shared) and j < len(owned):
+            if position(shared[i].__name__) < position(owned[j].__name__):
+                edges.append(shared[i])
+                i += 1
+            else:
+                edges.append(owned[j])
+                j += 1
+        edges += shared[i:]
+        edges += owned[j:]
+        return edges
+
+    def _degree(self, index, node):
+        return len(self._adjacent_edges(index, node))
+
+    def _mark_neighbours(self, node):
+        if not self._validated:
+            return
+        if IActivityEdge.providedBy(node):
+            self._mark([node.source, node.target])
+        elif IActivityNode.providedBy(node):
+            self._mark(self._adjacent_edges('_incoming', node))
+            self._mark(self._adjacent_edges('_outgoing', node))
+
+    def _reindex(self):
+        # the edges of base are indexed by base
+        self._incoming = dict()
+        self._outgoing = dict()
+        for edge in self._buckets.get(IActivityEdge, {}).values():
+            self._index_edge(edge)
+
+    def check_model_constraints(self):
+        super(ActivityVariant, self).check_model_constraints()
+        try:
+            assert IActivity.providedBy(self._base)
+        except AssertionError:
+            raise ModelIllFormedException,\
+                  str(self) +  " " +\
+                  "An ActivityVariant must have an Activity as base"
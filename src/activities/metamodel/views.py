@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+from zope.interface import implementedBy
+
+from activities.metamodel import elements
+from activities.metamodel.elements import _shared
+from activities.metamodel.interfaces import IAction
+from activities.metamodel.interfaces import IActivity
+from activities.metamodel.interfaces import IActivityNode
+from activities.metamodel.interfaces import IPostConstraint
+from activities.metamodel.interfaces import IPreConstraint
+from activities.metamodel.interfaces import IProfile
+from activities.metamodel.interfaces import IStereotype
+from activities.metamodel.snapshot import CLASSES
+
+# Read-only views of the elements of stored models, the behavior shared by
+# the views of the stores. A store derives its views from these classes and
+# provides, per view, _model and _i, the position of the element in tree
+# order, element_class, __name__, __parent__, keys, values, get and
+# filtereditems. Its model provides root, node(uuid) and _codes, a dict
+# caching compiled guards and specifications by the _code_key of the views.
+
+
+class ElementView(object):
+    """Read-only view of an element of a stored model.
+
+    Offers the read API and provides the interfaces of the model elements.
+    Views are created on access and compare equal if they show the same
+    element of the same model.
+    """
+
+    def __eq__(self, other):
+        return isinstance(other, ElementView) \
+           and other._model is self._model and other._i == self._i
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((id(self._model), self._i))
+
+    def __repr__(self):
+        return '<%s object \'%s\' at %s>' % (self.element_class.__name__,
+                                             self.__name__,
+                                             hex(id(self))[:-1])
+
+    __str__ = __repr__
+
+    # views provide the interfaces of the element class they show
+    __providedBy__ = property(lambda self: implementedBy(self.element_class))
+
+    @property
+    def root(self):
+        return self._model.root
+
+    @property
+    def path(self):
+        path = list()
+        node = self
+        while node is not None:
+            path.append(node.__name__)
+            node = node.__parent__
+        path.reverse()
+        return path
+
+    def node(self, uuid):
+        return self._model.node(uuid)
+
+    ### children
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        return [(value.__name__, value) for value in self.values()]
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError, key
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    @property
+    def stereotypes(self):
+        return list(self.filtereditems(IStereotype))
+
+    ### compiled guards and specifications, cached by the model as views are
+    ### short lived
+    def _get_code(self):
+        return self._model._codes.get(self._code_key)
+
+    def _set_code(self, code):
+        self._model._codes[self._code_key] = code
+
+
+class PackageView(ElementView):
+
+    @property
+    def profiles(self):
+        return list(self.filtereditems(IProfile))
+
+    @property
+    def activities(self):
+        return list(self.filtereditems(IActivity))
+
+
+class ActivityView(ElementView):
+
+    @property
+    def package(self):
+        return self.__parent__
+
+    @property
+    def nodes(self):
+        return list(self.filtereditems(IActivityNode))
+
+    @property
+    def actions(self):
+        return list(self.filtereditems(IAction))
+
+    @property
+    def preconditions(self):
+        return list(self.filtereditems(IPreConstraint))
+
+    @property
+    def postconditions(self):
+        return list(self.filtereditems(IPostConstraint))
+
+
+class ActivityNodeView(ElementView):
+
+    @property
+    def activity(self):
+        return self.__parent__
+
+    @property
+    def preconditions(self):
+        return list(self.filtereditems(IPreConstraint))
+
+    @property
+    def postconditions(self):
+        return list(self.filtereditems(IPostConstraint))
+
+
+class DecisionNodeView(ActivityNodeView):
+
+    decide = _shared(elements.DecisionNode, 'decide')
+
+
+class ActivityEdgeView(ElementView):
+
+    @property
+    def activity(self):
+        return self.__parent__
+
+    _guard = property(lambda self: self.guard)
+    _v_guard_code = property(ElementView._get_code, ElementView._set_code)
+
+    is_else = _shared(elements.ActivityEdge, 'is_else')
+    guard_code = _shared(elements.ActivityEdge, 'guard_code')
+    evaluate_guard = _shared(elements.ActivityEdge, 'evaluate_guard')
+
+
+class ConstraintView(ElementView):
+
+    @property
+    def constrained_element(self):
+        return self.__parent__
+
+    _specification = property(lambda self: self.specification)
+    _v_specification_code = property(ElementView._get_code,
+                                     ElementView._set_code)
+
+    specification_code = _shared(elements.Constraint, 'specification_code')
+    evaluate = _shared(elements.Constraint, 'evaluate')
+
+
+def view_classes(views, default):
+    """View class per class code, from views, a list of (interface, view
+    class) pairs, the first view whose interface the class implements. The
+    others are shown by default.
+    """
+    found = list()
+    for cls in CLASSES:
+        for iface, view in views:
+            if iface.implementedBy(cls):
+                found.append(view)
+                break
+        else:
+            found.append(default)
+    return found
@@ -0,0 +1,519 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009: Johannes Raggam, BlueDynamics Alliance
+#                 http://bluedynamics.com
+# GNU Lesser General Public License Version 2 or later
+
+"""Model interchange in UML2 XMI.
+
+Supported subset:
+- uml:Model and uml:Package as packages, uml:Activity, uml:Profile
+- activity nodes: uml:OpaqueAction and the control nodes of the metamodel
+- uml:ControlFlow and uml:ObjectFlow edges with guards
+- activity pre- and postconditions (ownedRule referenced by the precondition
+  and postcondition attributes) and local pre- and postconditions of actions
+- stereotype applications, i.e. elements in a profile namespace referencing
+  the extended element by a base_* attribute. Their other attributes and
+  simple child elements become tagged values.
+
+Value specifications may be uml:OpaqueExpression (body attribute or body
+child element), uml:LiteralString and uml:LiteralBoolean.
+"""
+
+__author__ = """Johannes Raggam <johannes@raggam.co.at>"""
+__docformat__ = 'plaintext'
+
+from xml.sax.saxutils import escape
+from xml.sax.saxutils import quoteattr
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+from activities.metamodel.elements import Package
+from activities.metamodel.elements import Activity
+from activities.metamodel.elements import ActivityEdge
+from activities.metamodel.elements import OpaqueAction
+from activities.metamodel.elements import InitialNode
+from activities.metamodel.elements import ActivityFinalNode
+from activities.metamodel.elements import FlowFinalNode
+from activities.metamodel.elements import DecisionNode
+from activities.metamodel.elements import ForkNode
+from activities.metamodel.elements import JoinNode
+from activities.metamodel.elements import MergeNode
+from activities.metamodel.elements import Constraint
+from activities.metamodel.elements import PreConstraint
+from activities.metamodel.elements import PostConstraint
+from activities.metamodel.elements import Profile
+from activities.metamodel.elements import Stereotype
+from activities.metamodel.elements import TaggedValue
+from activities.metamodel.elements import ModelIllFormedException
+from activities.metamodel.elements import _subtree
+from activities.metamodel.interfaces import IAction
+from activities.metamodel.interfaces import IActivity
+from activities.metamodel.interfaces import IActivityEdge
+from activities.metamodel.interfaces import IActivityNode
+from activities.metamodel.interfaces import IConstraint
+from activities.metamodel.interfaces import IPackage
+from activities.metamodel.interfaces import IPostConstraint
+from activities.metamodel.interfaces import IPreConstraint
+from activities.metamodel.interfaces import IProfile
+from activities.metamodel.interfaces import IStereotype
+from activities.metamodel.interfaces import ITaggedValue
+
+XMI_NS = 'http://schema.omg.org/spec/XMI/2.1'
+UML_NS = 'http://www.eclipse.org/uml2/3.0.0/UML'
+
+NODE_TYPES = {
+    'OpaqueAction': OpaqueAction,
+    'InitialNode': InitialNode,
+    'ActivityFinalNode': ActivityFinalNode,
+    'FlowFinalNode': FlowFinalNode,
+    'DecisionNode': DecisionNode,
+    'ForkNode': ForkNode,
+    'JoinNode': JoinNode,
+    'MergeNode': MergeNode,
+}
+
+EDGE_TYPES = ('ControlFlow', 'ObjectFlow')
+
+
+def _split(name):
+    """Split '{namespace}local' into (namespace, local).
+    """
+    if name[0] == '{':
+        namespace, local = name[1:].split('}', 1)
+        return namespace, local
+    return None, name
+
+
+class _Slot(object):
+    """Stack entry for elements holding a value specification or its body.
+    """
+
+    def __init__(self, owner, attr):
+        self.owner = owner
+        self.attr = attr
+
+    def assign(self, value):
+        setattr(self.owner, self.attr, value)
+
+
+class XMIReader(object):
+    """Streaming XMI reader.
+
+    Builds the model while parsing. Parsed XML elements are discarded as soon
+    as they are processed, so memory holds the model but never the document.
+    References to elements not read yet are kept in a table of pending
+    references and resolved once the referenced element is read.
+    """
+
+    def __init__(self):
+        self.model = None
+        self.xmi = XMI_NS
+        self.uml = UML_NS
+        self._prefixes = dict()
+        self._pending = dict()
+        self._conditions = dict()
+        self._stack = list()
+        self._elems = list()
+
+    def read(self, source):
+        """Read source, a file name or file object, and return the root
+        package.
+        """
+        for event, item in iterparse(source, events=('start-ns', 'start',
+                                                     'end')):
+            if event == 'start-ns':
+                prefix, uri = item
+                self._prefixes.setdefault(uri, prefix)
+                if prefix == 'xmi':
+                    self.xmi = uri
+                elif prefix == 'uml':
+                    self.uml = uri
+            elif event == 'start':
+                self._elems.append(item)
+                self._stack.append(self._start(item))
+            else:
+                self._end(item, self._stack.pop())
+                self._elems.pop()
+                # forget the processed subtree
+                item.clear()
+                if self._elems:
+                    self._elems[-1].remove(item)
+        if self._pending:
+            raise ModelIllFormedException,\
+                  u"Unresolved references to xmiids: " +\
+                  u", ".join(sorted(self._pending.keys()))
+        return self.model
+
+    ### helpers
+    def _attr(self, elem, name, namespace=None):
+        if namespace is not None:
+            name = '{%s}%s' % (namespace, name)
+        return elem.get(name)
+
+    def _type(self, elem):
+        xtype = self._attr(elem, 'type', self.xmi)
+        if xtype is None:
+            return None
+        return xtype.split(':')[-1]
+
+    def _id(self, elem):
+        return self._attr(elem, 'id', self.xmi)
+
+    def _add(self, parent, elem, node):
+        xmiid = self._id(elem)
+        node.xmiid = xmiid
+        key = self._attr(elem, 'name')
+        if not key or key in parent:
+            key = xmiid
+        parent[key] = node
+        self._created(xmiid, node)
+        return node
+
+    def _resolve(self, xmiid, callback):
+        node = self.model._xmiids.get(xmiid)
+        if node is not None:
+            callback(node)
+        else:
+            self._pending.setdefault(xmiid, list()).append(callback)
+
+    def _created(self, xmiid, node):
+        for callback in self._pending.pop(xmiid, ()):
+            callback(node)
+
+    def _value(self, elem, slot):
+        # literal value specifications carry their value as attribute
+        xtype = self._type(elem)
+        if xtype == 'LiteralBoolean':
+            value = self._attr(elem, 'value') or 'false'
+            slot.assign(value.lower() == 'true' and 'True' or 'False')
+        elif self._attr(elem, 'value') is not None:
+            slot.assign(self._attr(elem, 'value'))
+        elif self._attr(elem, 'body') is not None:
+            slot.assign(self._attr(elem, 'body'))
+        return slot
+
+    ### event handlers
+    def _start(self, elem):
+        if self._stack and self._stack[-1] is None:
+            # within skipped element
+            return None
+        parent = None
+        if self._stack:
+            parent = self._stack[-1]
+        namespace, tag = _split(elem.tag)
+        xtype = self._type(elem)
+        if self.model is None:
+            if tag in ('Model', 'Package') or xtype in ('Model', 'Package'):
+                self.model = Package(self._attr(elem, 'name'))
+                self.model.xmiid = self._id(elem)
+                return self.model
+            if namespace == self.xmi and tag == 'XMI':
+                return self
+            return None
+        if parent is self:
+            if namespace not in (self.xmi, self.uml):
+                return self._stereotype(elem, namespace, tag)
+            return None
+        if IPackage.providedBy(parent):
+            if xtype == 'Package':
+                return self._add(parent, elem, Package())
+            if xtype == 'Activity':
+                return self._activity(parent, elem)
+            if xtype == 'Profile':
+                self._add(parent, elem, Profile())
+                return None
+            return None
+        if IActivity.providedBy(parent):
+            if tag == 'node' and xtype in NODE_TYPES:
+                return self._add(parent, elem, NODE_TYPES[xtype]())
+            if tag == 'edge' and xtype in EDGE_TYPES:
+                return self._edge(parent, elem)
+            if tag in ('ownedRule', 'precondition', 'postcondition'):
+                return self._constraint(parent, elem, tag)
+            return None
+        if IAction.providedBy(parent):
+            if tag == 'localPrecondition':
+                return self._add(parent, elem, PreConstraint())
+            if tag == 'localPostcondition':
+                return self._add(parent, elem, PostConstraint())
+            return None
+        if IActivityEdge.providedBy(parent) and tag == 'guard':
+            return self._value(elem, _Slot(parent, 'guard'))
+        if IConstraint.providedBy(parent) and tag == 'specification':
+            return self._value(elem, _Slot(parent, 'specification'))
+        if isinstance(parent, _Slot) and tag == 'body':
+            return parent
+        if isinstance(parent, Stereotype):
+            # simple valued child element of a stereotype application
+            return _Slot(parent, tag)
+        return None
+
+    def _end(self, elem, entry):
+        if isinstance(entry, _Slot):
+            if isinstance(entry.owner, Stereotype):
+                if entry.attr not in entry.owner:
+                    entry.owner[entry.attr] = TaggedValue(value=elem.text)
+            elif _split(elem.tag)[1] == 'body':
+                entry.assign(elem.text or '')
+
+    def _activity(self, parent, elem):
+        activity = self._add(parent, elem, Activity())
+        # ids of owned rules to read as pre- and postconditions
+        self._conditions[activity.xmiid] = (
+            (self._attr(elem, 'precondition') or '').split(),
+            (self._attr(elem, 'postcondition') or '').split())
+        return activity
+
+    def _constraint(self, activity, elem, tag):
+        xmiid = self._id(elem)
+        preconditions, postconditions = self._conditions[activity.xmiid]
+        if tag == 'precondition' or xmiid in preconditions:
+            constraint = PreConstraint()
+        elif tag == 'postcondition' or xmiid in postconditions:
+            constraint = PostConstraint()
+        else:
+            constraint = Constraint()
+        return self._add(activity, elem, constraint)
+
+    def _edge(self, activity, elem):
+        edge = self._add(activity, elem, ActivityEdge())
+        source = self._attr(elem, 'source')
+        target = self._attr(elem, 'target')
+        if source is not None:
+            self._resolve(source, lambda node: setattr(edge, 'source', node))
+        if target is not None:
+            self._resolve(target, lambda node: setattr(edge, 'target', node))
+        return edge
+
+    def _stereotype(self, elem, namespace, tag):
+        base = None
+        values = list()
+        for name, value in elem.items():
+            attrns, attr = _split(name)
+            if attrns is not None:
+                continue
+            if attr.startswith('base_'):
+                base = value
+            else:
+                values.append((attr, value))
+        if base is None:
+            return None
+        stereotype = Stereotype(tag, profile=self._profile(namespace))
+        stereotype.xmiid = self._id(elem)
+        for attr, value in values:
+            stereotype[attr] = TaggedValue(value=value)
+        def apply(element):
+            key = tag
+            if key in element:
+                key = stereotype.xmiid
+            element[key] = stereotype
+            self._created(stereotype.xmiid, stereotype)
+        self._resolve(base, apply)
+        return stereotype
+
+    def _profile(self, namespace):
+        name = self._prefixes.get(namespace, namespace)
+        profile = self.model.get(name)
+        if not IProfile.providedBy(profile):
+            profile = self.model[name] = Profile()
+        return profile
+
+
+def load(source):
+    """Read the model from XMI source, a file name or file object.
+    """
+    return XMIReader().read(source)
+
+
+def _text(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+class XMIWriter(object):
+    """Streaming XMI writer.
+
+    Emits the elements while walking the model and writes them to the output
+    in chunks of about chunksize bytes, so the document is never built as a
+    whole. Elements without xmiid are written with their uuid as xmi:id.
+    """
+
+    def __init__(self, out, chunksize=65536):
+        self.out = out
+        self.chunksize = chunksize
+        self._buffer = list()
+        self._buffered = 0
+        self._namespaces = dict()
+
+    def write(self, model):
+        self._write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self._write('<xmi:XMI xmi:version="2.1" xmlns:xmi=%s xmlns:uml=%s' \
+                    % (quoteattr(XMI_NS), quoteattr(UML_NS)))
+        for profile in model.filtereditems(IProfile):
+            self._namespaces[profile.uuid] = profile.__name__
+            self._write(' xmlns:%s=%s' % (profile.__name__,
+                                         quoteattr(self._uri(profile))))
+        self._write('>\n')
+        self._start('uml:Model', model)
+        self._write('>\n')
+        self._package(model)
+        self._write('</uml:Model>\n')
+        # stereotype applications follow the model, in a second walk.
+        # Stereotypes defined in profiles are not written, applications
+        # referencing them are written with all their tagged values.
+        for node in _subtree(model):
+            if IStereotype.providedBy(node) \
+               and not IProfile.providedBy(node.__parent__):
+                self._stereotype(node)
+        self._write('</xmi:XMI>\n')
+        self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.out.write(''.join(self._buffer))
+            self._buffer = list()
+            self._buffered = 0
+
+    ### helpers
+    def _write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.chunksize:
+            self.flush()
+
+    def _id(self, node):
+        if node.xmiid is not None:
+            return node.xmiid
+        return str(node.uuid)
+
+    def _uri(self, profile):
+        return 'http:///schemas/%s/1' % profile.__name__
+
+    def _start(self, tag, node, xtype=None, **attrs):
+        self._write('<%s' % tag)
+        if xtype is not None:
+            self._write(' xmi:type="uml:%s"' % xtype)
+        self._write(' xmi:id=%s' % quoteattr(_text(self._id(node))))
+        if node.__name__ is not None:
+            self._write(' name=%s' % quoteattr(_text(node.__name__)))
+        for name in sorted(attrs.keys()):
+            if attrs[name]:
+                self._write(' %s=%s' % (name, quoteattr(_text(attrs[name]))))
+
+    def _expression(self, tag, owner, expression):
+        self._write('<%s xmi:type="uml:OpaqueExpression" xmi:id=%s>'
+                    '<body>%s</body></%s>' % (
+                        tag, quoteattr(_text(self._id(owner)) + '-' + tag),
+                        escape(_text(expression)), tag))
+
+    ### elements
+    def _package(self, package):
+        for node in package.values():
+            if IProfile.providedBy(node):
+                self._start('packagedElement', node, 'Profile')
+                self._write('/>\n')
+            elif IPackage.providedBy(node):
+                self._start('packagedElement', node, 'Package')
+                self._write('>\n')
+                self._package(node)
+                self._write('</packagedElement>\n')
+            elif IActivity.providedBy(node):
+                self._activity(node)
+
+    def _activity(self, activity):
+        ids = lambda nodes: ' '.join([self._id(node) for node in nodes])
+        self._start('packagedElement', activity, 'Activity',
+                    precondition=ids(activity.preconditions),
+                    postcondition=ids(activity.postconditions))
+        self._write('>\n')
+        for node in activity.values():
+            if IConstraint.providedBy(node):
+                self._constraint('ownedRule', node)
+            elif IActivityNode.providedBy(node):
+                self._node(node)
+            elif IActivityEdge.providedBy(node):
+                self._edge(node)
+        self._write('</packagedElement>\n')
+
+    def _node(self, node):
+        self._start('node', node, node.__class__.__name__)
+        constraints = list(node.filtereditems(IConstraint))
+        if not constraints:
+            self._write('/>\n')
+            return
+        self._write('>\n')
+        for constraint in constraints:
+            if IPreConstraint.providedBy(constraint):
+                self._constraint('localPrecondition', constraint)
+            elif IPostConstraint.providedBy(constraint):
+                self._constraint('localPostcondition', constraint)
+        self._write('</node>\n')
+
+    def _edge(self, edge):
+        source = edge.source
+        target = edge.target
+        self._start('edge', edge, 'ControlFlow',
+                    source=source is not None and self._id(source),
+                    target=target is not None and self._id(target))
+        if edge.guard is None:
+            self._write('/>\n')
+            return
+        self._write('>')
+        self._expression('guard', edge, edge.guard)
+        self._write('</edge>\n')
+
+    def _constraint(self, tag, constraint):
+        self._start(tag, constraint, 'Constraint')
+        if constraint.specification is None:
+            self._write('/>\n')
+            return
+        self._write('>')
+        self._expression('specification', constraint,
+                         constraint.specification)
+        self._write('</%s>\n' % tag)
+
+    def _stereotype(self, stereotype):
+        element = stereotype.__parent__
+        prefix = self._namespaces.get(stereotype.profile.uuid)
+        declaration = ''
+        if prefix is None:
+            # profile outside of the model, declare its namespace here
+            prefix = stereotype.profile.__name__
+            declaration = ' xmlns:%s=%s' % (
+                prefix, quoteattr(self._uri(stereotype.profile)))
+        tag = '%s:%s' % (prefix, stereotype.__name__)
+        self._write('<%s%s xmi:id=%s base_%s=%s' % (
+            tag, declaration, quoteattr(_text(self._id(stereotype))),
+            element.__class__.__name__,
+            quoteattr(_text(self._id(element)))))
+        empty = list()
+        for value in stereotype.filtereditems(ITaggedValue):
+            if value.value is None:
+                empty.append(value)
+            else:
+                self._write(' %s=%s' % (value.__name__,
+                                        quoteattr(_text(value.value))))
+        if not empty:
+            self._write('/>\n')
+            return
+        self._write('>')
+        for value in empty:
+            self._write('<%s/>' % value.__name__)
+        self._write('</%s>\n' % tag)
+
+
+def dump(model, out, chunksize=65536):
+    """Write model as XMI to out, a file name or file object.
+    """
+    if isinstance(out, basestring):
+        out = open(out, 'wb')
+        try:
+            XMIWriter(out, chunksize).write(model)
+        finally:
+            out.close()
+        return
+    XMIWriter(out, chunksize).write(model)